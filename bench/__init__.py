@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Outils de mesure du pipeline sans modèle ni réseau (faux serveur LLM, générateur de charge)."""
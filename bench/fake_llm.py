@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""Faux serveur LLM pour mesurer le pipeline sans modèle ni réseau.
+
+Répond sur un seul port aux protocoles utilisés par llm.backends:
+Ollama (/api/generate, /api/chat, JSON par ligne), OpenAI
+(/v1/chat/completions, SSE) et llama.cpp (/completion, SSE). Les tokens
+sont synthétiques ou rejoués depuis un enregistrement, avec un temps du
+premier token et un débit configurables. /api/embed renvoie des vecteurs
+de mots hachés, assez pour tester llm.retrieval.
+
+Syntaxe:
+    python3 -m bench.fake_llm [--port 11434] [--ttft 0.4] [--tps 25] [--replay streams.jsonl]
+    python3 -m bench.fake_llm --record streams.jsonl [--transcripts bench/transcripts.txt]
+"""
+
+import asyncio
+import codecs
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from optparse import OptionParser
+
+from llm.textmatch import normalize_text
+
+DEFAULT_PORT = 11434
+DEFAULT_TTFT = 0.4
+DEFAULT_TPS = 25.0
+DEFAULT_TRANSCRIPTS = "bench/transcripts.txt"
+EMBEDDING_DIM = 256
+
+SYNTHETIC_ANSWERS = [
+    u"Bonjour ! Je suis Pepper, le robot d'accueil. Je peux t'indiquer les salles, "
+    u"te donner l'heure ou simplement discuter avec toi. Que veux-tu savoir ?",
+    u"C'est une bonne question, mais je ne connais pas la réponse exacte. "
+    u"Tu peux demander à l'accueil, ils sauront sûrement t'aider.",
+    u"Les toilettes sont au fond du couloir, à droite après l'ascenseur. "
+    u"Tu ne peux pas les manquer.",
+    u"Il était une fois un petit robot qui voulait apprendre à danser. "
+    u"Chaque soir, il regardait les humains bouger, puis il essayait à son tour. "
+    u"Un jour, il a enfin réussi, et tout le monde a applaudi.",
+]
+
+_TOKEN = re.compile(u"\\s*[\\w'’-]+|\\s*[^\\w\\s]", re.UNICODE)
+
+def tokenize(text):
+    """Découpe grossière en tokens: mots avec leur espace, ponctuation à part."""
+    return _TOKEN.findall(text)
+
+def fake_embedding(text):
+    """Sac de mots haché: deux textes qui partagent des mots ont des vecteurs proches."""
+    vector = [0.0] * EMBEDDING_DIM
+    for word in normalize_text(text).split():
+        vector[zlib.crc32(word.encode("utf-8")) % EMBEDDING_DIM] += 1.0
+    return vector
+
+def load_transcripts(path=DEFAULT_TRANSCRIPTS):
+    """Une transcription par ligne; les lignes vides et les commentaires (#) sont ignorés."""
+    with codecs.open(path, "r", encoding="utf-8") as f:
+        return [l.strip() for l in f if l.strip() and not l.startswith("#")]
+
+class TokenStreams(object):
+    """Réponses à rejouer: {"match": "question", "tokens": [...]} ou {"text": "..."} par ligne."""
+
+    def __init__(self, streams=None):
+        self.streams = streams or [{"tokens": tokenize(t)} for t in SYNTHETIC_ANSWERS]
+        for stream in self.streams:
+            if "tokens" not in stream:
+                stream["tokens"] = tokenize(stream.get("text", u""))
+            stream["match"] = normalize_text(stream.get("match", u""))
+        self._cycle = itertools.cycle(self.streams)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with codecs.open(path, "r", encoding="utf-8") as f:
+            return cls([json.loads(l) for l in f if l.strip()])
+
+    def pick(self, question):
+        """La réponse enregistrée pour cette question, sinon la suivante à tour de rôle."""
+        question = normalize_text(question)
+        for stream in self.streams:
+            if stream["match"] and stream["match"] in question:
+                return stream["tokens"]
+        with self._lock:
+            return next(self._cycle)["tokens"]
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, streams=None, ttft=DEFAULT_TTFT, tps=DEFAULT_TPS,
+                 jitter=0.0, load_time=0.0, keep_alive=300.0):
+        ThreadingHTTPServer.__init__(self, address, FakeLLMHandler)
+        self.streams = streams or TokenStreams()
+        self.ttft = ttft
+        self.tps = tps
+        self.jitter = jitter
+        # Chargement du modèle simulé après keep_alive secondes sans requête
+        self.load_time = load_time
+        self.keep_alive = keep_alive
+        self.last_request = 0.0
+        self.requests = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def delay(self, seconds):
+        if self.jitter:
+            seconds *= max(0.0, random.gauss(1.0, self.jitter))
+        return seconds
+
+    def admit(self):
+        """Compte la requête et renvoie le temps de chargement à simuler (0 si le modèle est chaud)."""
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            cold = now - self.last_request > self.keep_alive
+            self.last_request = now
+        return self.load_time if cold else 0.0
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except ValueError:
+            self.send_error(400)
+            return
+        path = self.path.rstrip("/")
+        if path.endswith("/api/embed"):
+            self.embed(body)
+            return
+        if path.endswith("/api/generate"):
+            protocol = "generate"
+        elif path.endswith("/api/chat"):
+            protocol = "chat"
+        elif path.endswith("/chat/completions"):
+            protocol = "openai"
+        elif path.endswith("/completion"):
+            protocol = "llamacpp"
+        else:
+            self.send_error(404)
+            return
+
+        options = body.get("options") or {}
+        limit = options.get("num_predict") or body.get("max_tokens") or body.get("n_predict")
+        tokens = self.server.streams.pick(self.question(body))
+        tokens = tokens[:limit] if limit and limit > 0 else tokens
+        load = self.load = self.server.admit()
+        started = time.time()
+        time.sleep(load + self.server.delay(self.server.ttft))
+        prompt_done = time.time()
+        try:
+            if body.get("stream", True):
+                self.stream(protocol, body, tokens, started, prompt_done)
+            else:
+                for _ in tokens[1:]:
+                    time.sleep(self.server.delay(1.0 / self.server.tps))
+                self.reply(protocol, body, tokens, started, prompt_done)
+        except (BrokenPipeError, ConnectionResetError):
+            # Le client a annulé la génération (nouvel énoncé, bascule)
+            with self.server._lock:
+                self.server.cancelled += 1
+            self.close_connection = True
+
+    def embed(self, body):
+        texts = body.get("input")
+        texts = [texts] if not isinstance(texts, list) else texts
+        out = json.dumps({"model": body.get("model"),
+                          "embeddings": [fake_embedding(t) for t in texts]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def question(self, body):
+        messages = body.get("messages")
+        if messages:
+            users = [m.get("content", u"") for m in messages if m.get("role") == "user"]
+            return users[-1] if users else u""
+        return body.get("prompt", u"")[-200:]
+
+    def stream(self, protocol, body, tokens, started, prompt_done):
+        sse = protocol in ("openai", "llamacpp")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.server.delay(1.0 / self.server.tps))
+            self.chunk(protocol, self.message(protocol, body, token))
+        self.chunk(protocol, self.final(protocol, body, tokens, started, prompt_done))
+        if protocol == "openai":
+            self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def reply(self, protocol, body, tokens, started, prompt_done):
+        text = u"".join(tokens)
+        data = self.final(protocol, body, tokens, started, prompt_done)
+        if protocol == "generate":
+            data["response"] = text
+        elif protocol == "chat":
+            data["message"] = {"role": "assistant", "content": text}
+        elif protocol == "openai":
+            data["object"] = "chat.completion"
+            data["choices"] = [{"index": 0, "finish_reason": "stop",
+                                "message": {"role": "assistant", "content": text}}]
+        else:
+            data["content"] = text
+        out = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def message(self, protocol, body, token):
+        if protocol == "generate":
+            return {"model": body.get("model"), "response": token, "done": False}
+        if protocol == "chat":
+            return {"model": body.get("model"), "message": {"role": "assistant", "content": token}, "done": False}
+        if protocol == "openai":
+            return {"object": "chat.completion.chunk", "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+        return {"content": token, "stop": False}
+
+    def final(self, protocol, body, tokens, started, prompt_done):
+        now = time.time()
+        prompt_tokens = len(json.dumps(body.get("messages") or body.get("prompt", ""))) // 4
+        if protocol in ("generate", "chat"):
+            ns = lambda seconds: int(seconds * 1e9)
+            data = {"model": body.get("model"), "done": True, "done_reason": "stop",
+                    "total_duration": ns(now - started), "load_duration": ns(self.load),
+                    "prompt_eval_count": prompt_tokens, "prompt_eval_duration": ns(prompt_done - started),
+                    "eval_count": len(tokens), "eval_duration": ns(now - prompt_done)}
+            if protocol == "generate":
+                data["response"] = u""
+            else:
+                data["message"] = {"role": "assistant", "content": u""}
+            return data
+        if protocol == "openai":
+            return {"object": "chat.completion.chunk", "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                              "total_tokens": prompt_tokens + len(tokens)}}
+        return {"content": u"", "stop": True,
+                "timings": {"prompt_n": prompt_tokens, "prompt_ms": (prompt_done - started) * 1000,
+                            "predicted_n": len(tokens), "predicted_ms": (now - prompt_done) * 1000}}
+
+    def chunk(self, protocol, data):
+        line = json.dumps(data, ensure_ascii=False)
+        if protocol in ("openai", "llamacpp"):
+            self.write_chunk(("data: " + line + "\n\n").encode("utf-8"))
+        else:
+            self.write_chunk((line + "\n").encode("utf-8"))
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+async def record_streams(path, transcripts, chain="pipeline"):
+    """Enregistre les réponses du vrai backend configuré pour les rejouer ensuite."""
+    from llm.backends import Generation, build_backend
+    with codecs.open("pepper_prompt.txt", "r", encoding="utf-8") as f:
+        system = f.read()
+    backend = build_backend(chain)
+    try:
+        with codecs.open(path, "w", encoding="utf-8") as out:
+            for text in transcripts:
+                generation = Generation([{"role": "system", "content": system},
+                                         {"role": "user", "content": text}], {"max_tokens": 150})
+                tokens = [token.text async for token in backend.stream(generation)]
+                out.write(json.dumps({"match": text, "tokens": tokens}, ensure_ascii=False) + u"\n")
+                print("{} tokens ({}): {}".format(len(tokens), generation.backend, text))
+    finally:
+        await backend.close()
+
+parser = OptionParser()
+parser.add_option("--port", type="int", dest="port", help="Port d'écoute.")
+parser.add_option("--ttft", type="float", dest="ttft", help="Temps du premier token (s).")
+parser.add_option("--tps", type="float", dest="tps", help="Tokens par seconde.")
+parser.add_option("--jitter", type="float", dest="jitter",
+    help="Écart-type relatif des délais (0.2 = 20%).")
+parser.add_option("--load-time", type="float", dest="load_time",
+    help="Chargement simulé du modèle après --keep-alive secondes d'inactivité.")
+parser.add_option("--keep-alive", type="float", dest="keep_alive")
+parser.add_option("--replay", dest="replay", help="Fichier JSONL de réponses à rejouer.")
+parser.add_option("--record", dest="record",
+    help="Enregistre les réponses du backend réel dans ce fichier au lieu de servir.")
+parser.add_option("--transcripts", dest="transcripts", help="Questions à enregistrer.")
+parser.set_defaults(port=DEFAULT_PORT, ttft=DEFAULT_TTFT, tps=DEFAULT_TPS, jitter=0.0,
+                    load_time=0.0, keep_alive=300.0, transcripts=DEFAULT_TRANSCRIPTS)
+
+if __name__ == "__main__":
+    (opts, args_) = parser.parse_args()
+    if opts.record:
+        asyncio.run(record_streams(opts.record, load_transcripts(opts.transcripts)))
+    else:
+        streams = TokenStreams.load(opts.replay) if opts.replay else TokenStreams()
+        server = FakeLLMServer(("127.0.0.1", opts.port), streams, ttft=opts.ttft, tps=opts.tps,
+                               jitter=opts.jitter, load_time=opts.load_time, keep_alive=opts.keep_alive)
+        print("Faux LLM sur http://127.0.0.1:{} (ttft {}s, {} tok/s, {} reponses)".format(
+            opts.port, opts.ttft, opts.tps, len(streams.streams)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        print("{} requetes, {} annulees".format(server.requests, server.cancelled))
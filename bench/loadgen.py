@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Générateur de charge: rejoue des transcriptions et mesure le temps jusqu'au premier morceau TTS.
+
+Cible "pipeline": envoie les énoncés à gemma2_pipeline.py comme le STT
+(llm.events) et surveille tts_responses/. Lancer le pipeline sans
+pepper_tts_handler.py: le générateur retire lui-même les fichiers lus.
+Cible "oaiserver": envoie les énoncés à OaiServer par ZMQ; la réponse
+n'étant pas découpée, le premier morceau est la réponse entière.
+Avec --robots 1,3,10, chaque série simule autant de robots en parallèle
+(un fil par robot, dossier tts_responses/<robot>/) et compare la
+distribution des latences. bench/config.json désactive le cache de
+réponses (max_entries 0, sans réponses épinglées): chaque tour passe par
+le scheduler et le LLM, même quand les robots répètent les mêmes questions.
+
+Syntaxe:
+    python3 -m bench.fake_llm &
+    PEPPER_CONFIG=bench/config.json python3 gemma2_pipeline.py &
+    python3 -m bench.loadgen [pipeline|oaiserver] [--repeat 3] [--partial 0.4] [--out results.jsonl]
+    python3 -m bench.loadgen pipeline --robots 1,3,10
+"""
+
+import codecs
+import json
+import os
+import random
+import threading
+import time
+from optparse import OptionParser
+
+from bench.fake_llm import DEFAULT_TRANSCRIPTS, load_transcripts
+from llm.events import send_stt_event
+from llm.metrics import percentile
+from pepper_config import DEFAULT_ROBOT
+
+TTS_RESPONSE_DIR = "tts_responses"
+POLL_INTERVAL = 0.005
+
+def tts_files(directory=TTS_RESPONSE_DIR):
+    if not os.path.isdir(directory):
+        return set()
+    return set(f for f in os.listdir(directory) if f.startswith("response_"))
+
+def run_pipeline_turn(text, opts, robot=DEFAULT_ROBOT):
+    """Envoie un énoncé et attend ses morceaux; renvoie la mesure du tour."""
+    directory = opts.tts_dir if robot == DEFAULT_ROBOT else os.path.join(opts.tts_dir, robot)
+    seen = tts_files(directory)
+    if opts.partial:
+        # Transcription partielle puis finale, comme le STT à la fin de parole
+        send_stt_event(text, "partial", robot=robot)
+        time.sleep(opts.partial)
+    sent = time.time()
+    if not send_stt_event(text, robot=robot):
+        raise SystemExit("Le pipeline n'ecoute pas les evenements STT")
+    chunks = []
+    last = sent
+    while True:
+        now = time.time()
+        new = sorted(tts_files(directory) - seen)
+        for name in new:
+            chunks.append((now, name))
+            seen.add(name)
+        if new:
+            last = now
+        if now - last > (opts.settle if chunks else opts.timeout):
+            break
+        time.sleep(POLL_INTERVAL)
+    for _, name in chunks:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+    return {
+        "robot": robot,
+        "turn": text,
+        "first_chunk": round(chunks[0][0] - sent, 4) if chunks else None,
+        "last_chunk": round(chunks[-1][0] - sent, 4) if chunks else None,
+        "chunks": len(chunks),
+    }
+
+class OaiTarget(object):
+
+    def __init__(self):
+        import dotenv
+        import zmq
+        dotenv.load_dotenv()
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.connect(os.getenv("CHATBOT_SERVER_ADDRESS"))
+        self.send({"handshake": "loadgen"})
+
+    def send(self, message):
+        self.socket.send_json(message)
+        return self.socket.recv_json()
+
+    def run_turn(self, text, opts):
+        sent = time.time()
+        response = self.send({"input": text})
+        elapsed = round(time.time() - sent, 4)
+        choices = response.get("choices") or [{}]
+        return {
+            "turn": text,
+            "first_chunk": elapsed,
+            "last_chunk": elapsed,
+            "chunks": 1 if choices[0].get("message") else 0,
+            "backend": response.get("backend"),
+        }
+
+    def close(self):
+        self.context.destroy()
+
+def summarize(results, label=""):
+    values = [r["first_chunk"] for r in results if r["first_chunk"] is not None]
+    print("")
+    print("{}{} tours, {} sans reponse".format(label, len(results), len(results) - len(values)))
+    if values:
+        print("Premier morceau: moyenne {:.3f}s, p50 {:.3f}s, p90 {:.3f}s, p99 {:.3f}s, max {:.3f}s".format(
+            sum(values) / len(values), percentile(values, 50), percentile(values, 90),
+            percentile(values, 99), max(values)))
+    return values
+
+def run_robots(count, transcripts, opts, out):
+    """Simule count robots qui parlent en même temps, chacun à son rythme."""
+    results = []
+
+    def robot_loop(robot):
+        # Départs décalés: les visiteurs ne parlent pas tous à la même milliseconde
+        time.sleep(random.uniform(0, 1.0))
+        for i in range(opts.repeat):
+            for text in random.sample(transcripts, len(transcripts)):
+                result = run_pipeline_turn(text, opts, robot)
+                result["pass"] = i
+                result["robots"] = count
+                results.append(result)
+                if out:
+                    out.write(json.dumps(result, ensure_ascii=False) + u"\n")
+                time.sleep(opts.gap)
+
+    threads = [threading.Thread(target=robot_loop, args=("robot{}".format(n + 1),)) for n in range(count)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+parser = OptionParser(usage="%prog [pipeline|oaiserver] [options]")
+parser.add_option("--transcripts", dest="transcripts", help="Fichier de transcriptions.")
+parser.add_option("--repeat", type="int", dest="repeat", help="Nombre de passages sur les transcriptions.")
+parser.add_option("--gap", type="float", dest="gap", help="Pause entre deux tours (s).")
+parser.add_option("--partial", type="float", dest="partial",
+    help="Envoie d'abord une transcription partielle, ce nombre de secondes avant la finale.")
+parser.add_option("--settle", type="float", dest="settle",
+    help="Fin du tour après ce silence sans nouveau morceau (s).")
+parser.add_option("--timeout", type="float", dest="timeout", help="Attente maximale du premier morceau (s).")
+parser.add_option("--tts-dir", dest="tts_dir")
+parser.add_option("--out", dest="out", help="Écrit une ligne JSON par tour dans ce fichier.")
+parser.add_option("--robots", dest="robots",
+    help="Nombres de robots simulés, par série (ex. 1,3,10); cible pipeline seulement.")
+parser.set_defaults(transcripts=DEFAULT_TRANSCRIPTS, repeat=1, gap=0.5, partial=0.0,
+                    settle=1.0, timeout=30.0, tts_dir=TTS_RESPONSE_DIR)
+
+if __name__ == "__main__":
+    (opts, args) = parser.parse_args()
+    target = args[0] if args else "pipeline"
+    if target not in ("pipeline", "oaiserver"):
+        parser.error("cible inconnue: {}".format(target))
+    transcripts = load_transcripts(opts.transcripts)
+    oai = OaiTarget() if target == "oaiserver" else None
+    out = codecs.open(opts.out, "w", encoding="utf-8") if opts.out else None
+    results = []
+    if opts.robots:
+        if oai:
+            parser.error("--robots ne s'applique qu'au pipeline")
+        table = []
+        try:
+            for count in [int(n) for n in opts.robots.split(",")]:
+                values = summarize(run_robots(count, transcripts, opts, out), "{} robots: ".format(count))
+                table.append((count, values))
+        finally:
+            if out:
+                out.close()
+        print("")
+        print("robots   tours    p50     p90     p99     max")
+        for count, values in table:
+            if values:
+                print("{:>6} {:>7} {:>6.3f}s {:>6.3f}s {:>6.3f}s {:>6.3f}s".format(
+                    count, len(values), percentile(values, 50), percentile(values, 90),
+                    percentile(values, 99), max(values)))
+        raise SystemExit(0)
+    try:
+        for i in range(opts.repeat):
+            for text in transcripts:
+                result = oai.run_turn(text, opts) if oai else run_pipeline_turn(text, opts)
+                result["pass"] = i
+                results.append(result)
+                print("{:>7} {:2d} morceaux  {}".format(
+                    "{:.3f}s".format(result["first_chunk"]) if result["first_chunk"] is not None else "-",
+                    result["chunks"], text))
+                if out:
+                    out.write(json.dumps(result, ensure_ascii=False) + u"\n")
+                time.sleep(opts.gap)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out:
+            out.close()
+        if oai:
+            oai.close()
+    summarize(results)
@@ -1,29 +1,102 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
+import itertools
+import json
 import os
+import random
 import time
-import requests
-import json
+from collections import deque
+
+from llm.cache import AnswerCache
+from llm.events import TtsClients, serve_stt_events, watch_stt_file
+from llm.intents import IntentRouter
+from llm.phrases import FILLERS, reprompt
+from llm.metrics import MetricsRecorder, RECENT_TURNS, generation_metrics, percentile
+from llm.retrieval import Retriever, with_context
+from llm.scheduler import FairScheduler, DEFAULT_MAX_CONCURRENT
+from llm.backends import UNAVAILABLE_ANSWER, BackendError, Generation, build_backend
+from llm.segmenter import (ChunkPacker, ClauseSegmenter, SpokenBudget, CHARS_PER_SECOND, FIRST_CHUNK_MIN_CHARS,
+                           PACK_MAX_CHARS, PACK_TARGET_DURATION, SAY_OVERHEAD)
+from llm.textmatch import normalize_text, similarity
+from llm.tts_text import normalize_for_tts
+from pepper_config import DEFAULT_ROBOT, get_section
+from pepper_speaking import RESPONSE_INTERRUPT_FILE, take_interrupt
 
-GEMMA2_URL = "http://localhost:11434/api/generate"
-MODEL_NAME = "gemma2:9b"
 STT_FILE = "stt_result.txt"
 TTS_RESPONSE_DIR = "tts_responses"
+SPECULATIVE_THRESHOLD = 0.9
+FILLER_DEADLINE = 1.2
+RETRIEVAL_DEADLINE = 0.5
+PACKER_POLL = 0.05
+# Relecture des coupures écrites par le lecteur TTS en mode dossier
+INTERRUPT_FILE_INTERVAL = 0.05
+# En dessous, la transcription est jugée inutilisable (voir recognize_local.transcript_confidence)
+MIN_CONFIDENCE = 0.35
+# Phrases qui reviennent souvent: le lecteur TTS garde leur audio (voir pepper_tts_handler.PhraseCache)
+CACHEABLE_SOURCES = ("cache", "intent", "reprompt")
 
 with open("pepper_prompt.txt", "r", encoding="utf-8") as f:
     PEPPER_SYSTEM_PROMPT = f.read()
 
-def clean_response_for_windows(text):
-    if isinstance(text, str):
-        text = text.encode('ascii', 'ignore').decode('ascii')
-    return text.strip()
+# Gemma2 (Ollama) d'abord, puis les backends de secours de la chaîne "pipeline"
+llm_backend = build_backend("pipeline")
+PIPELINE_CONFIG = get_section("pipeline")
+answer_cache = AnswerCache.from_config()
+intent_router = IntentRouter()
+metrics = MetricsRecorder.from_config("pipeline")
+# Informations du lieu ajoutées à la question (None si l'index n'est pas construit)
+retriever = Retriever.from_config()
+# Une seule instance Ollama pour tous les robots
+scheduler = FairScheduler(PIPELINE_CONFIG.get("max_concurrent", DEFAULT_MAX_CONCURRENT))
+# Écarts entre phrases enchaînées et appels NAOqi, renvoyés par les lecteurs TTS
+playback_gaps = deque(maxlen=RECENT_TURNS)
+playback = {"sentences": 0, "cached": 0}
+naoqi_stats = {}
+# Coupures par le visiteur: délai jusqu'au silence et générations arrêtées
+interrupt_latencies = deque(maxlen=RECENT_TURNS)
+interrupts = {"count": 0, "stopped_generations": 0}
+
+def on_tts_message(robot, message):
+    if message.get("type") == "naoqi":
+        naoqi_stats[robot] = message.get("stats")
+    if message.get("type") == "interrupt":
+        interrupts["count"] += 1
+        if robot in sessions:
+            asyncio.ensure_future(sessions[robot].interrupt(message.get("turn")))
+    if message.get("type") != "played":
+        return
+    playback["sentences"] += 1
+    if message.get("cached"):
+        playback["cached"] += 1
+    if message.get("gap") is not None:
+        playback_gaps.append(message["gap"])
+    if message.get("interrupt_latency") is not None:
+        interrupt_latencies.append(message["interrupt_latency"])
+
+def playback_stats():
+    return dict(playback, gap_p50=percentile(list(playback_gaps), 50), gap_p99=percentile(list(playback_gaps), 99))
 
-def create_tts_response_file(text, chunk_id):
-    if not os.path.exists(TTS_RESPONSE_DIR):
-        os.makedirs(TTS_RESPONSE_DIR)
+def interrupt_stats():
+    latencies = list(interrupt_latencies)
+    return dict(interrupts, latency_p50=percentile(latencies, 50), latency_p99=percentile(latencies, 99))
+
+# Lecteurs TTS connectés; les robots sans lecteur connecté lisent tts_responses/
+tts_clients = TtsClients(on_tts_message)
+turn_ids = itertools.count(1)
+
+def robot_dir(robot):
+    """Dossier de sortie d'un robot; le robot par défaut garde tts_responses/."""
+    return TTS_RESPONSE_DIR if robot == DEFAULT_ROBOT else os.path.join(TTS_RESPONSE_DIR, robot)
+
+def create_tts_response_file(text, chunk_id, directory=TTS_RESPONSE_DIR, filler=False):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
     timestamp = int(time.time() * 1000)
-    filename = os.path.join(TTS_RESPONSE_DIR, "response_{:d}_{:03d}.txt".format(timestamp, chunk_id))
+    # Le lecteur coupe une phrase d'attente dès que la réponse arrive (.filler.txt)
+    filename = os.path.join(directory, "response_{:d}_{:03d}{}.txt".format(
+        timestamp, chunk_id, ".filler" if filler else ""))
     try:
         with open(filename, "w", encoding="utf-8") as f:
             f.write(text)
@@ -33,93 +106,480 @@ def create_tts_response_file(text, chunk_id):
         print("Erreur sauvegarde: {}".format(e))
         return None
 
-def send_to_gemma2_streaming_sentence(user_input):
-    """Version phrase par phrase au lieu de groupes de mots"""
-    full_prompt = PEPPER_SYSTEM_PROMPT + user_input
-    payload = {
-        "model": MODEL_NAME,
-        "prompt": full_prompt,
-        "stream": True,
-        "options": {
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "max_tokens": 150
+def create_command_file(intent, chunk_id, directory=TTS_RESPONSE_DIR):
+    """Ordre pour le robot, exécuté par pepper_tts_handler dans l'ordre des phrases."""
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    timestamp = int(time.time() * 1000)
+    filename = os.path.join(directory, "response_{:d}_{:03d}.cmd".format(timestamp, chunk_id))
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({"command": intent.name, "posture": intent.posture}, f)
+    print("Commande directe: {}".format(intent.name))
+    return filename
+
+def remove_unspoken_files(filenames):
+    """Retire les phrases d'un tour annulé que le TTS n'a pas encore lues."""
+    for filename in filenames:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+def new_segmenter():
+    return ClauseSegmenter(PIPELINE_CONFIG.get("first_chunk_min_chars", FIRST_CHUNK_MIN_CHARS))
+
+def new_budget():
+    return SpokenBudget(PIPELINE_CONFIG.get("max_sentences", 0), PIPELINE_CONFIG.get("max_chars", 0))
+
+def new_packer():
+    return ChunkPacker(PIPELINE_CONFIG.get("pack_target_duration", PACK_TARGET_DURATION),
+                       PIPELINE_CONFIG.get("pack_max_chars", PACK_MAX_CHARS),
+                       get_section("tts").get("chars_per_second", CHARS_PER_SECOND),
+                       PIPELINE_CONFIG.get("say_overhead", SAY_OVERHEAD))
+
+class Turn(object):
+    """Un énoncé et ce qui a été envoyé au TTS pour lui.
+
+    Un tour spéculatif (lancé sur une transcription partielle) garde ses
+    morceaux tant que la transcription finale ne l'a pas confirmé.
+    """
+
+    def __init__(self, text, speculative=False, received=None, robot=DEFAULT_ROBOT, confidence=None):
+        self.id = next(turn_ids)
+        self.text = text
+        self.robot = robot
+        self.speculative = speculative
+        self.confidence = confidence
+        # Rang de l'incompréhension si la transcription n'est pas fiable, sinon 0
+        self.misunderstandings = 0
+        self.started = time.time()
+        # Instant où l'énoncé est arrivé du STT, origine de toutes les mesures du tour
+        self.received = received or self.started
+        self.source = None
+        self.generation = None
+        self.status = "ok"
+        self.chunk_times = []
+        # Premier morceau prêt, gardé ou envoyé (gain mesuré des tours spéculatifs)
+        self.ready_at = None
+        self.filler_at = None
+        self.retrieval = None
+        self.slot_wait = None
+        self.files = []
+        self.pushed = False
+        # Le visiteur a coupé la parole pendant la réponse
+        self.interrupted = False
+        self.task = None
+        self.released = asyncio.Event()
+        self._held = []
+        self._chunk_id = 0
+        if not speculative:
+            self.released.set()
+
+    def say(self, text):
+        # Seule mise en forme du texte avant la synthèse (accents conservés)
+        clean_text = normalize_for_tts(text)
+        if not clean_text:
+            return False
+        self._output("say", clean_text)
+        return True
+
+    def command(self, intent):
+        self._output("command", intent)
+
+    def filler(self, text):
+        """Phrase d'attente, dite seulement si rien n'est encore parti pour ce tour."""
+        if self.chunk_times or self._held or self.filler_at:
+            return False
+        if self.generation is not None and self.generation.first_token_at is not None:
+            # La réponse arrive déjà: le premier morceau est imminent, l'attente ne se remplit pas
+            return False
+        self.filler_at = time.time()
+        self._output("filler", normalize_for_tts(text))
+        return True
+
+    def release(self, text):
+        """Confirme un tour spéculatif: les morceaux gardés partent au TTS."""
+        self.text = text
+        held, self._held = self._held, []
+        self.released.set()
+        for kind, payload in held:
+            self._output(kind, payload)
+
+    async def cancel(self):
+        """Annule la génération en cours; renvoie True si elle tournait encore."""
+        if not self.task or self.task.done():
+            return False
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        remove_unspoken_files(f for f in self.files if f)
+        if self.pushed:
+            # Le lecteur jette les morceaux du tour qu'il n'a pas encore dits
+            tts_clients.send(self.robot, {"type": "cancel", "turn": self.id})
+        return True
+
+    def _output(self, kind, payload):
+        if kind == "say" and self.ready_at is None:
+            self.ready_at = time.time()
+        if not self.released.is_set():
+            self._held.append((kind, payload))
+            return
+        if kind == "command":
+            message = {"type": "command", "command": payload.name, "posture": payload.posture}
+        else:
+            message = {"type": "say", "text": payload, "filler": kind == "filler",
+                       "cache": kind == "filler" or self.source in CACHEABLE_SOURCES}
+        message.update(turn=self.id, seq=self._chunk_id)
+        # Le lecteur connecté reçoit le morceau tout de suite; sinon, fichier dans tts_responses/
+        if tts_clients.send(self.robot, message):
+            self.pushed = True
+            print("Commande directe: {}".format(payload.name) if kind == "command"
+                  else "Groupe envoye: [{}]".format(payload))
+        elif kind == "command":
+            self.files.append(create_command_file(payload, self._chunk_id, robot_dir(self.robot)))
+        else:
+            self.files.append(create_tts_response_file(payload, self._chunk_id, robot_dir(self.robot),
+                                                       kind == "filler"))
+        if kind == "say":
+            self.chunk_times.append(time.time())
+        self._chunk_id += 1
+
+    def metrics(self):
+        record = {
+            "robot": self.robot,
+            "turn": self.text,
+            "source": self.source,
+            "speculative": self.speculative,
+            "confidence": self.confidence,
+            "status": self.status,
+            "chunks": [round(t - self.received, 4) for t in self.chunk_times],
+            "first_chunk": round(self.chunk_times[0] - self.received, 4) if self.chunk_times else None,
+            "filler": round(self.filler_at - self.received, 4) if self.filler_at else None,
         }
-    }
+        if self.retrieval is not None:
+            record["retrieval"] = self.retrieval
+        if self.slot_wait is not None:
+            record["slot_wait"] = round(self.slot_wait, 4)
+        if self.generation is not None:
+            record["queue_wait"] = round(self.generation.created - self.received, 4)
+            record.update(generation_metrics(self.generation))
+        return record
+
+def speak_text(text, turn):
+    """Envoie une réponse déjà connue (cache) au TTS, découpée comme un flux."""
+    segmenter = new_segmenter()
+    packer = new_packer()
+    for chunk in segmenter.feed(text) + segmenter.flush():
+        for packed in packer.add(chunk):
+            turn.say(packed)
+    for packed in packer.flush():
+        turn.say(packed)
+
+async def retrieve_context(turn):
+    """Ajoute à la question les passages utiles de l'index; la question seule si la recherche échoue."""
+    if retriever is None:
+        return turn.text
+    start = time.time()
     try:
-        response = requests.post(GEMMA2_URL, json=payload, stream=True, timeout=60)
-        if response.status_code != 200:
-            print("Erreur Gemma2 HTTP {}".format(response.status_code))
-            return False
+        passages = await asyncio.wait_for(retriever.retrieve(turn.text),
+                                          get_section("retrieval").get("deadline", RETRIEVAL_DEADLINE))
+    except Exception as e:
+        print("Recherche d'informations impossible: {}".format(e.__class__.__name__))
+        passages = []
+    turn.retrieval = {"time": round(time.time() - start, 4), "passages": len(passages),
+                      "scores": [round(score, 3) for score, _ in passages]}
+    return with_context(turn.text, passages)
 
-        accumulated_text = ""
-        chunk_counter = 0
+async def stream_answer(turn, question):
+    """Envoie la réponse au TTS morceau par morceau (voir llm.segmenter); question porte déjà le contexte."""
+    # Le prompt système ne change jamais (préfixe en cache); le contexte va avec la question
+    messages = [
+        {"role": "system", "content": PEPPER_SYSTEM_PROMPT},
+        {"role": "user", "content": question}
+    ]
+    options = {
+        "temperature": 0.7,
+        "top_p": 0.9,
+        "max_tokens": 150
+    }
+    generation = turn.generation = Generation(messages, options)
+    segmenter = new_segmenter()
+    budget = new_budget()
+    packer = new_packer()
+    spoken = []
 
-        for line in response.iter_lines():
-            if not line:
-                continue
-            try:
-                data = json.loads(line.decode('utf-8'))
-                if 'response' not in data:
-                    continue
-                token = data['response']
-                accumulated_text += token
-
-                # Envoie par phrase complète (ponctuation forte)
-                if any(p in token for p in '.!?'):
-                    clean_text = clean_response_for_windows(accumulated_text)
-                    if clean_text:
-                        create_tts_response_file(clean_text, chunk_counter)
-                        chunk_counter += 1
-                        time.sleep(0.2)
-                    accumulated_text = ""
-            except:
-                continue
+    def speak(chunks):
+        for chunk in chunks:
+            if turn.say(chunk):
+                spoken.append(chunk)
+
+    # Les morceaux regroupés partent quand le TTS va avoir fini, même si le modèle hésite
+    release = asyncio.ensure_future(release_when_idle(packer, speak))
+    tokens = llm_backend.stream(generation)
+    try:
+        async for token in tokens:
+            # Premier morceau dès une fin de proposition, puis phrase par phrase
+            for chunk in segmenter.feed(token.text):
+                if budget.take(chunk):
+                    speak(packer.add(chunk))
+            if budget.exhausted:
+                # Ferme le flux HTTP: le backend arrête de générer
+                generation.truncated = True
+                print("Budget de parole atteint ({} phrases, {} caracteres)".format(budget.sentences, budget.chars))
+                break
 
         # Envoie le reste
-        if accumulated_text.strip():
-            clean_text = clean_response_for_windows(accumulated_text.strip())
-            if clean_text:
-                create_tts_response_file(clean_text, chunk_counter)
+        for chunk in segmenter.flush():
+            if budget.take(chunk):
+                speak(packer.add(chunk))
+        speak(packer.flush())
 
-        return True
+        return u" ".join(spoken)
 
+    except BackendError as e:
+        print("Erreur LLM: {}".format(e))
     except Exception as e:
         msg = str(e).encode('ascii', 'ignore').decode('ascii')
-        print("Erreur connexion Gemma2: {}".format(msg))
-        return False
+        print("Erreur connexion LLM ({}): {}".format(generation.backend, msg))
+    finally:
+        release.cancel()
+        await tokens.aclose()
+    turn.status = "error"
+    # Ce qui a été généré avant l'erreur est dit quand même
+    speak(packer.flush())
+    # Aucun backend n'a répondu: Pepper le dit plutôt que de rester muet
+    if not spoken:
+        turn.say(UNAVAILABLE_ANSWER)
+    return None
+
+async def release_when_idle(packer, speak):
+    """Envoie le texte en attente dans le ChunkPacker quand le TTS va finir ce qu'il a reçu."""
+    while True:
+        due = packer.next_due()
+        await asyncio.sleep(PACKER_POLL if due is None else max(0.0, due - time.time()))
+        speak(packer.due())
+
+async def filler_after_deadline(turn):
+    """Masque l'attente: phrase d'attente si aucun morceau n'est prêt dans le délai du tour.
+
+    Le délai part de l'arrivée de la transcription. Elle n'est pas dite si
+    les tokens arrivent déjà, et le lecteur TTS la coupe dès que le premier
+    morceau de la réponse lui parvient: la réponse ne l'attend jamais.
+    """
+    deadline = PIPELINE_CONFIG.get("filler_deadline", FILLER_DEADLINE)
+    if not deadline:
+        return
+    await asyncio.sleep(max(0.0, turn.received + deadline - time.time()))
+    # Un tour spéculatif ne parle qu'une fois confirmé
+    await turn.released.wait()
+    fillers = PIPELINE_CONFIG.get("fillers") or FILLERS
+    if turn.filler(random.choice(fillers)):
+        # Indicateur de santé du backend: fréquence des réponses trop lentes
+        metrics.count("fillers")
+        print("Phrase d'attente apres {:.2f}s".format(turn.filler_at - turn.received))
+
+async def respond(turn):
+    try:
+        await answer(turn)
+    except asyncio.CancelledError:
+        turn.status = "interrupted" if turn.interrupted else "cancelled"
+        raise
+    finally:
+        record = metrics.record(turn.metrics())
+        if record["first_chunk"] is not None:
+            print("Premier morceau en {:.2f}s ({})".format(record["first_chunk"], turn.source))
+
+async def answer(turn):
+    print("{}{} dit: {}".format("[{}] ".format(turn.robot) if turn.robot != DEFAULT_ROBOT else "",
+                                "Utilisateur (partiel)" if turn.speculative else "Utilisateur", turn.text))
+    # Transcription peu fiable: relance immédiate plutôt qu'une réponse à du bruit
+    if turn.misunderstandings:
+        turn.source = "reprompt"
+        turn.say(reprompt(turn.misunderstandings))
+        metrics.count("reprompts")
+        print("Transcription peu fiable (confiance {:.2f}), relance".format(turn.confidence))
+        return
+    # Les ordres de mouvement n'attendent pas le modèle
+    intent = intent_router.match(turn.text)
+    if intent:
+        turn.source = "intent"
+        turn.command(intent)
+        turn.say(intent.ack())
+        return
+    cached = answer_cache.get(turn.text)
+    if cached:
+        turn.source = "cache"
+        speak_text(cached, turn)
+        print("Reponse en cache ({hit_rate:.0%} de succes)".format(**answer_cache.stats()))
+        return
+    turn.source = "llm"
+    filler = asyncio.ensure_future(filler_after_deadline(turn))
+    try:
+        # La recherche se fait avant de prendre une place: elle n'occupe pas le serveur de génération
+        question = await retrieve_context(turn)
+        # Une place de génération sur le serveur partagé, attribuée équitablement entre robots
+        async with scheduler.slot(turn.robot, not turn.released.is_set()) as wait:
+            turn.slot_wait = wait
+            spoken = await stream_answer(turn, question)
+    finally:
+        filler.cancel()
+    print("Streaming Pepper: {}".format("OK" if spoken else "ERREUR"))
+    if spoken:
+        # Une réponse spéculative n'entre en cache qu'une fois confirmée
+        await turn.released.wait()
+        answer_cache.put(turn.text, spoken)
+
+# saved: somme des gains sur les "measured" tours confirmés répondus par le modèle (hors cache)
+speculation = {"hits": 0, "misses": 0, "measured": 0, "saved": 0.0}
+
+def same_utterance(a, b):
+    a, b = normalize_text(a), normalize_text(b)
+    return a == b or similarity(a, b) >= PIPELINE_CONFIG.get("speculative_threshold", SPECULATIVE_THRESHOLD)
+
+def report_speculation():
+    total = speculation["hits"] + speculation["misses"]
+    print("Speculation: {}/{} confirmees, {:.2f}s gagnees en moyenne".format(
+        speculation["hits"], total, speculation["saved"] / speculation["measured"] if speculation["measured"] else 0.0))
 
-def monitor_stt_and_respond():
-    last_text = ""
+class Session(object):
+    """État d'un robot: son tour en cours et sa file d'énoncés, traités dans l'ordre.
+
+    Un nouvel énoncé annule la génération en cours du même robot. Une
+    transcription partielle (fin de parole probable) lance la génération
+    tout de suite; la finale la confirme ou la relance.
+    """
+
+    def __init__(self, robot):
+        self.robot = robot
+        self.current = None
+        self.misunderstandings = 0
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            await self.handle(await self.queue.get())
+
+    async def handle(self, event):
+        current = self.current
+        text = (event.get("text") or "").strip()
+        partial = event.get("type") == "partial"
+        if not text or (partial and not PIPELINE_CONFIG.get("speculative", True)):
+            return
+        confidence = event.get("confidence")
+        unclear = confidence is not None and confidence < PIPELINE_CONFIG.get("min_confidence", MIN_CONFIDENCE)
+        if unclear and partial:
+            # Pas de génération spéculative sur une transcription douteuse
+            return
+        if current and current.speculative and not current.released.is_set() and not unclear:
+            if same_utterance(current.text, text):
+                if not partial:
+                    speculation["hits"] += 1
+                    if current.source != "cache":
+                        # Gain réel: avance du premier morceau prêt sur la transcription finale
+                        final = event.get("received") or time.time()
+                        speculation["measured"] += 1
+                        speculation["saved"] += max(0.0, final - current.ready_at) if current.ready_at else 0.0
+                    self.misunderstandings = 0
+                    current.release(text)
+                    report_speculation()
+                return
+            if not partial:
+                speculation["misses"] += 1
+                report_speculation()
+        if current and await current.cancel():
+            print("Nouvel enonce, annulation de la generation en cours")
+        self.current = Turn(text, speculative=partial, received=event.get("received"), robot=self.robot,
+                            confidence=confidence)
+        if not partial:
+            self.misunderstandings = self.misunderstandings + 1 if unclear else 0
+            self.current.misunderstandings = self.misunderstandings if unclear else 0
+        self.current.task = asyncio.ensure_future(respond(self.current))
+
+    async def interrupt(self, turn_id=None):
+        """Le visiteur parle par-dessus la réponse: la génération de ce tour s'arrête.
+
+        Sans turn_id (mode dossier, les fichiers ne portent pas de tour), le tour en cours est visé.
+        """
+        current = self.current
+        if current is None or (turn_id is not None and current.id != turn_id):
+            return
+        current.interrupted = True
+        if await current.cancel():
+            interrupts["stopped_generations"] += 1
+            print("Parole coupee par le visiteur, generation arretee")
+
+    async def close(self):
+        self.task.cancel()
+        if self.current:
+            await self.current.cancel()
+
+sessions = {}
+
+async def handle_stt_events(queue):
+    """Répartit les événements STT entre les sessions, selon le champ "robot" de l'événement."""
+    while True:
+        event = await queue.get()
+        robot = event.get("robot") or DEFAULT_ROBOT
+        if robot not in sessions:
+            sessions[robot] = Session(robot)
+            print("Nouveau robot: {} ({} sessions)".format(robot, len(sessions)))
+        sessions[robot].queue.put_nowait(event)
+
+async def watch_interrupt_files(interval=INTERRUPT_FILE_INTERVAL):
+    """Mode dossier: la coupure écrite par le lecteur TTS arrête le tour en cours du robot."""
+    while True:
+        for robot, session in list(sessions.items()):
+            if take_interrupt(os.path.join(robot_dir(robot), RESPONSE_INTERRUPT_FILE)) is not None:
+                await session.interrupt()
+        await asyncio.sleep(interval)
+
+async def monitor_stt_and_respond():
     print("Pepper AI Pipeline - STREAMING PHRASES COMPLETES actif")
     print("Surveillance du fichier: {}".format(STT_FILE))
 
-    while True:
-        if os.path.exists(STT_FILE):
-            try:
-                with open(STT_FILE, "r", encoding="utf-8") as f:
-                    text = f.read().strip()
-                if text and text != last_text:
-                    print("Utilisateur dit: {}".format(text))
-                    result = send_to_gemma2_streaming_sentence(text)
-                    print("Streaming Pepper: {}".format("OK" if result else "ERREUR"))
-                    last_text = text
-                try:
-                    os.remove(STT_FILE)
-                except:
-                    with open(STT_FILE, "w") as f:
-                        f.write("")
-            except Exception as e:
-                msg = str(e).encode('ascii', 'ignore').decode('ascii')
-                print("Erreur traitement: {}".format(msg))
-        time.sleep(0.2)
+    queue = asyncio.Queue()
+    server = await serve_stt_events(queue)
+    tts_server = await tts_clients.serve()
+    watcher = asyncio.ensure_future(watch_stt_file(queue, STT_FILE))
+    interrupt_watcher = asyncio.ensure_future(watch_interrupt_files())
+    metrics.add_source("cache", answer_cache.stats)
+    metrics.add_source("speculation", lambda: dict(speculation))
+    metrics.add_source("scheduler", scheduler.stats)
+    metrics.add_source("playback", playback_stats)
+    metrics.add_source("naoqi", lambda: dict(naoqi_stats))
+    metrics.add_source("interrupts", interrupt_stats)
+    if get_section("metrics").get("pipeline_port"):
+        metrics.start_server(get_section("metrics")["pipeline_port"])
+    # Charge le modèle et met le prompt système en cache avant la première question
+    llm_backend.start_warmer(PEPPER_SYSTEM_PROMPT)
+    if retriever is not None:
+        retriever.start_warmer()
+    try:
+        await handle_stt_events(queue)
+    finally:
+        watcher.cancel()
+        interrupt_watcher.cancel()
+        server.close()
+        tts_server.close()
+        for session in sessions.values():
+            await session.close()
+        await llm_backend.close()
+        if retriever is not None:
+            await retriever.close()
 
 if __name__ == "__main__":
     print("=== PEPPER AI CHATBOT - STREAMING PHRASES COMPLETES ===")
-    if os.path.isdir(TTS_RESPONSE_DIR):
-        for f in os.listdir(TTS_RESPONSE_DIR):
+    # Retire aussi les phrases restées dans les dossiers des autres robots
+    for root, dirs, files in os.walk(TTS_RESPONSE_DIR):
+        for f in files:
             try:
-                os.remove(os.path.join(TTS_RESPONSE_DIR, f))
+                os.remove(os.path.join(root, f))
             except:
                 pass
-    monitor_stt_and_respond()
+    try:
+        asyncio.run(monitor_stt_and_respond())
+    except KeyboardInterrupt:
+        print("Arret par l'utilisateur.")
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Accès aux modèles de langage locaux (Ollama) pour le pipeline Pepper."""
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""Interface commune de génération en flux pour Ollama, les serveurs compatibles
+OpenAI et llama.cpp (llama-server), avec bascule automatique.
+
+Chaque backend renvoie des Token (texte + instant de réception) et remplit
+une Generation avec les temps de la requête. FailoverBackend essaie les
+backends dans l'ordre: si le premier token n'arrive pas dans le budget
+(ttft_budget) ou si la requête échoue, il passe au suivant. Un disjoncteur
+écarte pendant un temps un backend qui échoue à répétition.
+"""
+
+import abc
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import httpx
+
+from llm.ollama import AsyncOllamaClient, OllamaError
+from pepper_config import get_section, load_config
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_TTFT_BUDGET = 4.0
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 30.0
+
+# Étiquettes du prompt brut (/api/generate, llama.cpp), cohérentes avec pepper_prompt.txt
+USER_LABEL = u"Utilisateur : "
+ASSISTANT_LABEL = u"Pepper : "
+
+Token = namedtuple("Token", "text time")
+
+# Dite au visiteur quand aucun backend ne répond
+UNAVAILABLE_ANSWER = u"Désolé, je n'arrive pas à réfléchir pour le moment. Peux-tu réessayer dans un instant ?"
+
+class BackendError(Exception):
+    pass
+
+class Generation(object):
+    """Une requête au modèle et ses temps (secondes, horloge time.time())."""
+
+    def __init__(self, messages, options=None):
+        self.messages = messages
+        self.options = options or {}
+        self.created = time.time()
+        self.backend = None
+        self.started = None
+        self.first_token_at = None
+        self.finished_at = None
+        self.tokens = 0
+        self.token_times = []
+        self.connect_time = None
+        self.headers_at = None
+        self._connect_started = None
+        self.stats = {}
+        self.error = None
+        self.attempts = []
+        # Flux fermé avant la fin par l'appelant (budget de parole atteint)
+        self.truncated = False
+
+    @property
+    def ttft(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.created
+
+    def restart(self, backend):
+        self.backend = backend
+        self.started = time.time()
+        self.first_token_at = None
+        self.finished_at = None
+        self.tokens = 0
+        self.token_times = []
+        self.connect_time = None
+        self.headers_at = None
+        self._connect_started = None
+        self.stats = {}
+        self.error = None
+
+    async def trace(self, event, info):
+        """Extension "trace" de httpx: temps de connexion (0 si la connexion est réutilisée)."""
+        now = time.time()
+        if event in ("connection.connect_tcp.started", "connection.start_tls.started"):
+            self._connect_started = now
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete") \
+                and self._connect_started is not None:
+            self.connect_time = (self.connect_time or 0.0) + now - self._connect_started
+        elif event.endswith("receive_response_headers.complete"):
+            self.headers_at = now
+            if self.connect_time is None:
+                self.connect_time = 0.0
+
+def prompt_from_messages(messages):
+    """Prompt brut: prompt système puis l'échange; un seul tour donne système + question."""
+    system = u"".join(m["content"] for m in messages if m["role"] == "system")
+    turns = [m for m in messages if m["role"] != "system"]
+    prompt = system
+    for m in turns[:-1]:
+        prompt += m["content"] + u"\n" + (ASSISTANT_LABEL if m["role"] == "user" else USER_LABEL)
+    if turns:
+        prompt += turns[-1]["content"]
+    return prompt
+
+class CircuitBreaker(object):
+    """Ouvert après failure_threshold échecs consécutifs, puis un essai après cooldown secondes."""
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+
+    def allow(self):
+        return time.time() >= self.open_until
+
+    def success(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.open_until = time.time() + self.cooldown
+            print("Backend {} ecarte pendant {:.0f}s".format(self.name, self.cooldown))
+
+class Backend(abc.ABC):
+    """Base des adaptateurs: _tokens() renvoie le texte brut, stream() ajoute temps et échéance."""
+
+    # Nom des options communes (Generation.options) dans l'API du backend
+    OPTIONS = {"temperature": "temperature", "top_p": "top_p", "max_tokens": "max_tokens", "stop": "stop"}
+
+    def __init__(self, name, url, model=None, timeout=DEFAULT_TIMEOUT, deadline=None,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.deadline = deadline
+        self.breaker = CircuitBreaker(name, failure_threshold, cooldown)
+
+    @classmethod
+    def from_section(cls, name, section, defaults):
+        return cls(name, section.get("url", cls.DEFAULT_URL), model=section.get("model"),
+                   timeout=section.get("timeout", DEFAULT_TIMEOUT),
+                   deadline=section.get("deadline"),
+                   failure_threshold=defaults.get("failure_threshold", DEFAULT_FAILURE_THRESHOLD),
+                   cooldown=defaults.get("cooldown", DEFAULT_COOLDOWN))
+
+    async def stream(self, generation):
+        """Renvoie les Token de la réponse; s'arrête si l'échéance du backend est dépassée."""
+        generation.restart(self.name)
+        tokens = self._tokens(generation)
+        try:
+            while True:
+                try:
+                    if self.deadline:
+                        remaining = self.deadline - (time.time() - generation.started)
+                        text = await asyncio.wait_for(tokens.__anext__(), max(remaining, 0))
+                    else:
+                        text = await tokens.__anext__()
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    generation.error = "deadline"
+                    print("Backend {}: echeance de {}s depassee".format(self.name, self.deadline))
+                    break
+                except (httpx.HTTPError, OSError) as e:
+                    # Coupure réseau, y compris en cours de flux: une seule erreur à gérer pour l'appelant
+                    raise BackendError("{}: {}".format(self.name, str(e) or e.__class__.__name__)) from e
+                now = time.time()
+                if generation.first_token_at is None:
+                    generation.first_token_at = now
+                generation.tokens += 1
+                generation.token_times.append(now)
+                yield Token(text, now)
+        finally:
+            await tokens.aclose()
+            generation.finished_at = time.time()
+
+    def map_options(self, options):
+        """Traduit les options communes; celles que le backend ne connaît pas sont ignorées."""
+        return dict((self.OPTIONS[k], v) for k, v in options.items() if k in self.OPTIONS)
+
+    @abc.abstractmethod
+    def _tokens(self, generation):
+        """À fournir par chaque adaptateur: générateur asynchrone des morceaux de texte de la réponse."""
+
+    def start_warmer(self, prompt=None):
+        pass
+
+    async def close(self):
+        pass
+
+class HttpBackend(Backend):
+
+    def __init__(self, *args, **kwargs):
+        self.api_key = kwargs.pop("api_key", None)
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout))
+
+    async def _sse(self, payload, generation):
+        """Lit un flux "data: {...}" (OpenAI, llama.cpp) et renvoie les objets JSON."""
+        headers = {"Authorization": "Bearer " + self.api_key} if self.api_key else None
+        async with self.client.stream("POST", self.url, json=payload, headers=headers,
+                                      extensions={"trace": generation.trace}) as response:
+            if response.status_code != 200:
+                raise BackendError("{}: HTTP {}".format(self.name, response.status_code))
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    yield json.loads(data)
+                except ValueError:
+                    continue
+
+    async def close(self):
+        await self.client.aclose()
+
+class OllamaBackend(Backend):
+    """Ollama: /api/generate (prompt brut, comme avant) ou /api/chat selon l'URL configurée."""
+
+    DEFAULT_URL = "http://localhost:11434/api/generate"
+    # Ollama ignore max_tokens: la longueur se règle avec num_predict
+    OPTIONS = dict(Backend.OPTIONS, max_tokens="num_predict")
+    STATS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration",
+             "eval_count", "eval_duration")
+
+    def __init__(self, name, client, **kwargs):
+        super().__init__(name, client.url, model=client.model, timeout=client.timeout, **kwargs)
+        self.client = client
+
+    @classmethod
+    def from_section(cls, name, section, defaults):
+        return cls(name, AsyncOllamaClient.from_section(section),
+                   deadline=section.get("deadline"),
+                   failure_threshold=defaults.get("failure_threshold", DEFAULT_FAILURE_THRESHOLD),
+                   cooldown=defaults.get("cooldown", DEFAULT_COOLDOWN))
+
+    async def _tokens(self, generation):
+        if self.client.is_chat():
+            payload = self.client.build_chat_payload(generation.messages, self.map_options(generation.options))
+        else:
+            payload = self.client.build_payload(prompt_from_messages(generation.messages),
+                                                self.map_options(generation.options))
+        try:
+            async for data in self.client.stream_json(payload, trace=generation.trace):
+                text = data.get("response") or (data.get("message") or {}).get("content")
+                if text:
+                    yield text
+                if data.get("done"):
+                    generation.stats = dict((k, data[k]) for k in self.STATS if k in data)
+        except OllamaError as e:
+            raise BackendError("{}: {}".format(self.name, e))
+
+    def start_warmer(self, prompt=None):
+        self.client.start_warmer(prompt)
+
+    async def close(self):
+        await self.client.close()
+
+class OpenAIBackend(HttpBackend):
+    """Serveur compatible OpenAI (/v1/chat/completions en flux SSE)."""
+
+    DEFAULT_URL = "https://api.openai.com/v1/chat/completions"
+
+    @classmethod
+    def from_section(cls, name, section, defaults):
+        backend = super().from_section(name, section, defaults)
+        backend.api_key = os.getenv(section.get("api_key_env", "OPENAI_KEY"))
+        return backend
+
+    async def _tokens(self, generation):
+        payload = {"model": self.model, "messages": generation.messages, "stream": True}
+        payload.update(self.map_options(generation.options))
+        async for data in self._sse(payload, generation):
+            if data.get("usage"):
+                generation.stats = data["usage"]
+            choices = data.get("choices") or [{}]
+            text = (choices[0].get("delta") or {}).get("content")
+            if text:
+                yield text
+
+class LlamaCppBackend(HttpBackend):
+    """llama.cpp server, point d'accès natif /completion (cache_prompt garde le préfixe système)."""
+
+    DEFAULT_URL = "http://localhost:8080/completion"
+    OPTIONS = dict(Backend.OPTIONS, max_tokens="n_predict")
+
+    async def _tokens(self, generation):
+        payload = {"prompt": prompt_from_messages(generation.messages), "stream": True, "cache_prompt": True}
+        payload.update(self.map_options(generation.options))
+        async for data in self._sse(payload, generation):
+            if data.get("content"):
+                yield data["content"]
+            if data.get("stop"):
+                generation.stats = data.get("timings") or {}
+                break
+
+class FailoverBackend(object):
+    """Essaie les backends dans l'ordre tant qu'aucun token n'a été envoyé."""
+
+    def __init__(self, backends, ttft_budget=DEFAULT_TTFT_BUDGET):
+        self.backends = backends
+        self.ttft_budget = ttft_budget
+
+    async def stream(self, generation):
+        candidates = [b for b in self.backends if b.breaker.allow()]
+        for i, backend in enumerate(candidates):
+            # Le dernier candidat n'a pas de budget: mieux vaut une réponse lente que rien
+            budget = self.ttft_budget if i < len(candidates) - 1 else None
+            tokens = backend.stream(generation)
+            try:
+                first = await asyncio.wait_for(tokens.__anext__(), budget)
+            except StopAsyncIteration:
+                backend.breaker.success()
+                return
+            except asyncio.TimeoutError:
+                reason = "premier token en plus de {}s".format(budget)
+            except (BackendError, httpx.HTTPError, OSError) as e:
+                reason = str(e) or e.__class__.__name__
+            else:
+                backend.breaker.success()
+                try:
+                    yield first
+                    async for token in tokens:
+                        yield token
+                finally:
+                    await tokens.aclose()
+                return
+            await tokens.aclose()
+            backend.breaker.failure()
+            generation.attempts.append((backend.name, reason))
+            print("Backend {} indisponible ({}), bascule".format(backend.name, reason))
+        generation.error = "unavailable"
+        raise BackendError("Aucun backend disponible")
+
+    def start_warmer(self, prompt=None):
+        for backend in self.backends:
+            backend.start_warmer(prompt)
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.close()
+
+class BlockingBackend(object):
+    """Pour le code synchrone (OaiChat): une boucle asyncio dédiée tourne dans un thread."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever)
+        thread.daemon = True
+        thread.start()
+
+    def complete(self, messages, options=None):
+        """Renvoie (texte complet, Generation)."""
+        generation = Generation(messages, options)
+        future = asyncio.run_coroutine_threadsafe(self._collect(generation), self.loop)
+        return future.result(), generation
+
+    async def _collect(self, generation):
+        return u"".join([token.text async for token in self.backend.stream(generation)])
+
+BACKEND_TYPES = {
+    "ollama": OllamaBackend,
+    "openai": OpenAIBackend,
+    "llamacpp": LlamaCppBackend,
+}
+
+def build_backend(chain, config=None):
+    """Construit la chaîne de backends "chain" de la section "llm" de config.json.
+
+    Chaque nom de la chaîne désigne une section de config.json dont la clé
+    "type" choisit l'adaptateur (ollama par défaut).
+    """
+    config = config if config is not None else load_config()
+    defaults = get_section("llm", config)
+    backends = []
+    for name in defaults.get(chain) or ["gemma2"]:
+        section = get_section(name, config)
+        backends.append(BACKEND_TYPES[section.get("type", "ollama")].from_section(name, section, defaults))
+    return FailoverBackend(backends, ttft_budget=defaults.get("ttft_budget", DEFAULT_TTFT_BUDGET))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Cache des réponses aux questions fréquentes, placé devant le modèle.
+
+Les transcriptions sont normalisées (casse, accents, ponctuation) puis
+cherchées à l'identique. Seules les entrées épinglées (réponses rédigées
+à la main, toujours présentes) sont aussi cherchées de façon
+approximative (Levenshtein): une réponse apprise du modèle ne vaut que
+pour sa question exacte ("ton frère" n'est pas "ton père"). Les entrées
+apprises expirent (TTL) et sont évincées par LRU.
+"""
+
+import codecs
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from llm.textmatch import best_match, normalize_text
+from pepper_config import get_section
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 3600
+DEFAULT_FUZZY_THRESHOLD = 0.88
+MONTHS = (u"janvier", u"février", u"mars", u"avril", u"mai", u"juin", u"juillet",
+          u"août", u"septembre", u"octobre", u"novembre", u"décembre")
+
+class CacheEntry(object):
+    __slots__ = ("answer", "expires", "pinned", "hits")
+
+    def __init__(self, answer, expires=None, pinned=False):
+        self.answer = answer
+        self.expires = expires
+        self.pinned = pinned
+        self.hits = 0
+
+class AnswerCache(object):
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 fuzzy_threshold=DEFAULT_FUZZY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fuzzy_threshold = fuzzy_threshold
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_config(cls, config=None):
+        section = get_section("cache", config)
+        cache = cls(max_entries=section.get("max_entries", DEFAULT_MAX_ENTRIES),
+                    ttl=section.get("ttl", DEFAULT_TTL),
+                    fuzzy_threshold=section.get("fuzzy_threshold", DEFAULT_FUZZY_THRESHOLD))
+        if section.get("pinned_file"):
+            cache.load_pinned(section["pinned_file"])
+        return cache
+
+    def load_pinned(self, path):
+        """Charge des réponses rédigées: {"question": "réponse", ...}."""
+        if not os.path.isfile(path):
+            print("WARNING: reponses epinglees introuvables: {}".format(path))
+            return
+        with codecs.open(path, "r", encoding="utf-8") as f:
+            for question, answer in json.load(f).items():
+                self.pin(question, answer)
+
+    def pin(self, question, answer):
+        key = normalize_text(question)
+        if key:
+            self._pinned[key] = CacheEntry(answer, pinned=True)
+
+    def put(self, question, answer, ttl=None):
+        key = normalize_text(question)
+        if not key or not answer or key in self._pinned:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = CacheEntry(answer, time.time() + ttl if ttl else None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, question):
+        """Renvoie la réponse en cache pour cette question, ou None."""
+        key = normalize_text(question)
+        if not key:
+            return None
+        entry = self._lookup(key)
+        if entry is not None:
+            self.exact_hits += 1
+        else:
+            self._expire()
+            match, _ = best_match(key, list(self._pinned), self.fuzzy_threshold)
+            entry = self._pinned.get(match) if match else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.fuzzy_hits += 1
+        entry.hits += 1
+        return self._render(entry)
+
+    def stats(self):
+        lookups = self.exact_hits + self.fuzzy_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "pinned": len(self._pinned),
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.fuzzy_hits) / float(lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _lookup(self, key):
+        entry = self._pinned.get(key)
+        if entry is not None:
+            return entry
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires is not None and entry.expires < time.time():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _expire(self):
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if e.expires is not None and e.expires < now]:
+            del self._entries[key]
+            self.expirations += 1
+
+    def _render(self, entry):
+        # Les réponses épinglées peuvent contenir {heure} ou {date}, en toutes lettres pour le TTS;
+        # les autres accolades restent telles quelles
+        if not entry.pinned or u"{" not in entry.answer:
+            return entry.answer
+        now = datetime.now()
+        hour = u"{} heure{}".format(now.hour, u"s" if now.hour > 1 else u"")
+        date = u"{}{} {} {}".format(now.day, u"er" if now.day == 1 else u"", MONTHS[now.month - 1], now.year)
+        return (entry.answer.replace(u"{heure}", u"{} {:02d}".format(hour, now.minute) if now.minute else hour)
+                .replace(u"{date}", date))
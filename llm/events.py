@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Transmission des résultats STT au pipeline sous forme d'événements.
+
+Le STT pousse une ligne JSON par résultat sur une socket TCP locale
+({"type": "final", "text": "..."}). La surveillance de stt_result.txt est
+conservée comme mode de compatibilité.
+
+Dans l'autre sens, pepper_tts_handler.py se connecte au pipeline et
+reçoit les morceaux à dire, une ligne JSON par morceau, avec l'identifiant
+du tour et le rang du morceau; il renvoie sur la même connexion une
+ligne par phrase dite (durée, écart avec la précédente). Tant qu'aucun lecteur n'est connecté pour
+un robot, le pipeline écrit les morceaux dans tts_responses/ comme avant.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import time
+
+from pepper_config import get_section
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5570
+DEFAULT_TTS_PORT = 5571
+STT_FILE = "stt_result.txt"
+
+def events_address(config=None):
+    section = get_section("pipeline", config)
+    return section.get("events_host", DEFAULT_HOST), section.get("events_port", DEFAULT_PORT)
+
+def tts_address(config=None):
+    section = get_section("pipeline", config)
+    return section.get("events_host", DEFAULT_HOST), section.get("tts_port", DEFAULT_TTS_PORT)
+
+def send_stt_event(text, event_type="final", address=None, **fields):
+    """Envoie un résultat STT au pipeline; renvoie False si le pipeline n'écoute pas."""
+    event = dict(fields, type=event_type, text=text)
+    try:
+        conn = socket.create_connection(address or events_address(), timeout=1.0)
+    except (OSError, socket.timeout):
+        return False
+    try:
+        conn.sendall((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+    finally:
+        conn.close()
+    return True
+
+async def serve_stt_events(queue, address=None):
+    """Serveur TCP: chaque ligne JSON reçue est placée dans la file d'événements."""
+    host, port = address or events_address()
+
+    async def on_client(reader, writer):
+        try:
+            async for line in reader:
+                try:
+                    event = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    continue
+                if isinstance(event, dict) and event.get("text") is not None:
+                    event["received"] = time.time()
+                    await queue.put(event)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(on_client, host, port)
+    print("Evenements STT ecoutes sur {}:{}".format(host, port))
+    return server
+
+class TtsClients(object):
+    """Lecteurs TTS connectés, un par robot: {"hello": robot} puis une ligne JSON par morceau.
+
+    on_message(robot, message) reçoit les lignes renvoyées par le lecteur.
+    """
+
+    def __init__(self, on_message=None):
+        self.writers = {}
+        self.on_message = on_message
+
+    def connected(self, robot):
+        writer = self.writers.get(robot)
+        return writer is not None and not writer.is_closing()
+
+    def send(self, robot, message):
+        """Envoie un message au lecteur du robot; renvoie False s'il n'y en a pas."""
+        if not self.connected(robot):
+            return False
+        self.writers[robot].write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        return True
+
+    async def serve(self, address=None):
+        host, port = address or tts_address()
+
+        async def on_client(reader, writer):
+            robot = None
+            try:
+                try:
+                    hello = json.loads((await reader.readline()).decode("utf-8"))
+                    robot = hello["hello"]
+                except (ValueError, KeyError, TypeError):
+                    return
+                previous = self.writers.get(robot)
+                if previous is not None:
+                    previous.close()
+                self.writers[robot] = writer
+                print("Lecteur TTS connecte: {}".format(robot))
+                async for line in reader:
+                    try:
+                        message = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        continue
+                    if self.on_message and isinstance(message, dict):
+                        self.on_message(robot, message)
+            finally:
+                if robot is not None and self.writers.get(robot) is writer:
+                    del self.writers[robot]
+                    print("Lecteur TTS deconnecte: {}, retour aux fichiers".format(robot))
+                writer.close()
+
+        server = await asyncio.start_server(on_client, host, port)
+        print("Lecteurs TTS attendus sur {}:{}".format(host, port))
+        return server
+
+async def watch_stt_file(queue, path=STT_FILE, interval=0.2):
+    """Mode compatibilité: convertit stt_result.txt en événements."""
+    last_text = ""
+    while True:
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read().strip()
+                if text and text != last_text:
+                    await queue.put({"type": "final", "text": text, "received": time.time()})
+                    last_text = text
+                try:
+                    os.remove(path)
+                except OSError:
+                    with open(path, "w") as f:
+                        f.write("")
+            except Exception as e:
+                msg = str(e).encode('ascii', 'ignore').decode('ascii')
+                print("Erreur lecture STT: {}".format(msg))
+        await asyncio.sleep(interval)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Fenêtre de l'historique de conversation envoyée au modèle.
+
+Le prompt système et les derniers tours sont gardés dans un budget de
+tokens; les tours plus anciens sont résumés en arrière-plan et remplacés
+par ce résumé. La taille du prompt reste ainsi stable quelle que soit la
+durée de la session. Les tokens sont comptés avec tiktoken s'il est
+installé, sinon estimés d'après le nombre de caractères.
+"""
+
+import threading
+from functools import lru_cache
+
+from pepper_config import get_section
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_BUDGET = 1500
+DEFAULT_SUMMARY_TOKENS = 200
+# Coût fixe d'un message (rôle, séparateurs) dans le format chat
+MESSAGE_OVERHEAD = 4
+CHARS_PER_TOKEN = 4
+SUMMARY_PREFIX = u"Résumé de la conversation précédente: "
+
+_encoding = None
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Table de tokens non téléchargeable: on reste sur l'estimation
+            _encoding = False
+    return _encoding
+
+@lru_cache(maxsize=2048)
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def count_message_tokens(message):
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+def as_message(entry):
+    """Les lignes ajoutées en texte brut à l'historique sont traitées comme des messages utilisateur."""
+    if isinstance(entry, dict):
+        return entry
+    return {"role": "user", "content": u"{}".format(entry)}
+
+class HistoryWindow(object):
+    """Choisit les messages à envoyer; summarizer(résumé, messages) renvoie le nouveau résumé."""
+
+    def __init__(self, summarizer=None, budget=DEFAULT_BUDGET, summary_tokens=DEFAULT_SUMMARY_TOKENS):
+        self.summarizer = summarizer
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reset()
+
+    @classmethod
+    def from_config(cls, summarizer=None, config=None):
+        section = get_section("history", config)
+        return cls(summarizer, budget=section.get("budget", DEFAULT_BUDGET),
+                   summary_tokens=section.get("summary_tokens", DEFAULT_SUMMARY_TOKENS))
+
+    def reset(self):
+        with self._lock:
+            self.summary = u""
+            # Nombre de messages du dialogue déjà repris dans le résumé
+            self.folded = 0
+            self._epoch = getattr(self, "_epoch", 0) + 1
+
+    def messages(self, history):
+        """Prompt système, résumé des anciens tours, puis les derniers tours qui tiennent dans le budget."""
+        entries = [as_message(e) for e in history]
+        system = [m for m in entries if m["role"] == "system"]
+        dialogue = [m for m in entries if m["role"] != "system"]
+        with self._lock:
+            summary, folded = self.summary, self.folded
+        if summary:
+            system = system + [{"role": "system", "content": SUMMARY_PREFIX + summary}]
+
+        available = self.budget - sum(count_message_tokens(m) for m in system)
+        start, used = len(dialogue), 0
+        while start > folded:
+            cost = count_message_tokens(dialogue[start - 1])
+            # Le dernier message part toujours, même s'il dépasse le budget à lui seul
+            if start < len(dialogue) and used + cost > available:
+                break
+            used += cost
+            start -= 1
+        # La fenêtre commence sur une question, pas sur une réponse isolée
+        while start < len(dialogue) - 1 and dialogue[start]["role"] != "user":
+            start += 1
+        if start > folded:
+            self._fold(dialogue[folded:start], start)
+        return system + dialogue[start:]
+
+    def prompt_tokens(self, messages):
+        return sum(count_message_tokens(m) for m in messages)
+
+    def _fold(self, messages, upto):
+        """Lance le résumé des messages sortis de la fenêtre, s'il n'y en a pas déjà un en cours."""
+        if self.summarizer is None or (self._thread and self._thread.is_alive()):
+            return
+        with self._lock:
+            summary, epoch = self.summary, self._epoch
+        self._thread = threading.Thread(target=self._summarize, args=(summary, messages, upto, epoch))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _summarize(self, summary, messages, upto, epoch):
+        try:
+            summary = self.summarizer(summary, messages)
+        except Exception as e:
+            print("Resume de l'historique impossible: {}".format(e))
+            return
+        if not summary:
+            return
+        with self._lock:
+            # Une remise à zéro pendant le résumé l'invalide
+            if epoch == self._epoch and upto > self.folded:
+                self.summary = summary.strip()
+                self.folded = upto
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Reconnaissance directe des ordres au robot, avant tout appel au modèle (Python 2 et 3).
+
+La transcription normalisée est comparée à une table de commandes: d'abord
+par expressions régulières compilées, puis par similarité de Levenshtein
+avec des phrases modèles pour tolérer les erreurs du STT. Un ordre fait
+bouger le robot: l'énoncé entier doit être l'ordre (formules de politesse
+admises), sans négation ni question; sinon le modèle répond.
+"""
+
+import random
+import re
+
+from llm.textmatch import best_match, normalize_text
+
+DEFAULT_FUZZY_THRESHOLD = 0.88
+# Comparaison approchée seulement avec les modèles de longueur voisine (écart relatif)
+MAX_FUZZY_LENGTH_GAP = 0.2
+# Mots tolérés avant et après l'ordre lui-même
+_POLITE = u"(?:pepper|robot|allez|ok|d accord|maintenant|s il te plait|s il vous plait|stp|merci)"
+_NEGATION = re.compile(u"\\b(ne|n|pas|jamais)\\b", re.UNICODE)
+# Une demande polie ("tu peux t'asseoir ?") reste un ordre malgré le point d'interrogation
+_REQUEST = re.compile(u"^(?:%s )*(tu peux|peux tu|pourrais tu|tu pourrais)\\b" % _POLITE, re.UNICODE)
+
+class Intent(object):
+
+    def __init__(self, name, posture, patterns, templates, acks):
+        self.name = name
+        self.posture = posture
+        # Chaque motif doit couvrir tout l'énoncé
+        self.patterns = [re.compile(u"^(?:%s )*(?:%s)(?: %s)*$" % (_POLITE, p, _POLITE), re.UNICODE)
+                         for p in patterns]
+        self.templates = [normalize_text(t) for t in templates]
+        self.acks = acks
+
+    def ack(self):
+        return random.choice(self.acks)
+
+# Les motifs portent sur le texte normalisé (minuscules, sans accents ni ponctuation).
+# Les modèles, pour la comparaison approchée, sont des impératifs courts: une demande
+# ("tu peux t'asseoir") n'est reconnue que par motif, "tu veux t'asseoir" n'en est pas une.
+COMMANDS = [
+    Intent("sit", "Sit",
+           [u"(assieds|assied|assois|assoie|assoies|assis) toi",
+            u"(tu peux|peux tu|pourrais tu|tu pourrais) t asseoir"],
+           [u"assieds-toi", u"assois-toi"],
+           [u"D'accord, je m'assois.", u"Je m'assois."]),
+    Intent("stand", "Stand",
+           [u"(leve|leves|releve|releves) toi",
+            u"(tu peux|peux tu|pourrais tu|tu pourrais) te (lever|relever)",
+            u"mets toi debout"],
+           [u"lève-toi", u"relève-toi", u"mets-toi debout"],
+           [u"D'accord, je me lève.", u"Je me mets debout."]),
+    Intent("lie", "LyingBack",
+           [u"(allonge|allonges) toi",
+            u"(tu peux|peux tu|pourrais tu|tu pourrais) t allonger"],
+           [u"allonge-toi"],
+           [u"D'accord, je m'allonge.", u"Je m'allonge."]),
+]
+
+class IntentRouter(object):
+
+    def __init__(self, commands=None, fuzzy_threshold=DEFAULT_FUZZY_THRESHOLD):
+        self.commands = commands or COMMANDS
+        self.fuzzy_threshold = fuzzy_threshold
+        self._by_template = dict((t, c) for c in self.commands for t in c.templates)
+
+    def match(self, transcript):
+        """Renvoie l'Intent correspondant à la transcription, ou None."""
+        if isinstance(transcript, bytes):
+            transcript = transcript.decode("utf-8", "ignore")
+        text = normalize_text(transcript)
+        if not text or _NEGATION.search(text):
+            return None
+        if u"?" in transcript and not _REQUEST.match(text):
+            return None
+        for command in self.commands:
+            for pattern in command.patterns:
+                if pattern.match(text):
+                    return command
+        # Tolérance aux erreurs du STT: l'énoncé entier ressemble à un ordre de même longueur
+        templates = [t for t in self._by_template if abs(len(t) - len(text)) <= MAX_FUZZY_LENGTH_GAP * len(t)]
+        template, _ = best_match(text, templates, self.fuzzy_threshold)
+        return self._by_template.get(template)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Mesures de latence par requête LLM: fichier JSONL tournant et point d'accès HTTP.
+
+Pour chaque tour: attente en file, connexion, temps du premier token,
+écarts entre tokens (p50/p99), tokens par seconde, instant d'envoi de
+chaque morceau au TTS, durée totale, et les compteurs d'Ollama
+(eval_count, eval_duration, prompt_eval_duration).
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+from pepper_config import get_section
+
+DEFAULT_LOG_DIR = "logs"
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+RECENT_TURNS = 200
+
+def percentile(values, q):
+    """Percentile au rang le plus proche (q entre 0 et 100)."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(q / 100.0 * len(values))) - 1
+    return values[max(0, min(len(values) - 1, rank))]
+
+def _round(value, digits=4):
+    return None if value is None else round(value, digits)
+
+def generation_metrics(generation):
+    """Résumé des temps d'une Generation (llm.backends)."""
+    times = generation.token_times
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    streaming = times[-1] - times[0] if len(times) > 1 else None
+    record = {
+        "backend": generation.backend,
+        "attempts": generation.attempts,
+        "error": generation.error,
+        "connect": _round(generation.connect_time),
+        "headers": _round(generation.headers_at - generation.started if generation.headers_at else None),
+        "ttft": _round(generation.ttft),
+        "tokens": generation.tokens,
+        "tokens_per_s": _round((len(times) - 1) / streaming if streaming else None, 2),
+        "gap_p50": _round(percentile(gaps, 50)),
+        "gap_p99": _round(percentile(gaps, 99)),
+        "generation_time": _round(generation.finished_at - generation.created if generation.finished_at else None),
+        "truncated": generation.truncated,
+    }
+    stats = generation.stats
+    if "eval_count" in stats:
+        # Ollama donne ses durées en nanosecondes
+        record["ollama"] = {
+            "prompt_eval_count": stats.get("prompt_eval_count"),
+            "prompt_eval_duration": _round(stats.get("prompt_eval_duration", 0) / 1e9),
+            "eval_count": stats["eval_count"],
+            "eval_duration": _round(stats.get("eval_duration", 0) / 1e9),
+            "load_duration": _round(stats.get("load_duration", 0) / 1e9),
+            "eval_rate": _round(stats["eval_count"] / (stats["eval_duration"] / 1e9), 2)
+            if stats.get("eval_duration") else None,
+        }
+    elif stats:
+        record["server"] = stats
+    return record
+
+class MetricsRecorder(object):
+    """Écrit une ligne JSON par tour dans logs/metrics.<name>.jsonl et garde les derniers en mémoire."""
+
+    def __init__(self, name, log_dir=DEFAULT_LOG_DIR, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self.name = name
+        self.recent = deque(maxlen=RECENT_TURNS)
+        self.counters = {}
+        self.sources = {}
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger("pepper.metrics." + name)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers and log_dir:
+            if not os.path.isdir(log_dir):
+                os.makedirs(log_dir)
+            handler = RotatingFileHandler(os.path.join(log_dir, "metrics.{}.jsonl".format(name)),
+                                          maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    @classmethod
+    def from_config(cls, name, config=None):
+        section = get_section("metrics", config)
+        return cls(name, log_dir=section.get("dir", DEFAULT_LOG_DIR),
+                   max_bytes=section.get("max_bytes", DEFAULT_MAX_BYTES),
+                   backups=section.get("backups", DEFAULT_BACKUPS))
+
+    def record(self, record):
+        record = dict(record, time=datetime.now().isoformat())
+        with self._lock:
+            self.recent.append(record)
+        self.logger.info(json.dumps(record, ensure_ascii=False))
+        return record
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def add_source(self, name, stats):
+        """Ajoute une source de statistiques (fonction sans argument) au point d'accès."""
+        self.sources[name] = stats
+
+    def summary(self):
+        with self._lock:
+            recent = list(self.recent)
+            counters = dict(self.counters)
+        summary = {"turns": len(recent), "counters": counters}
+        for key in ("queue_wait", "ttft", "first_chunk", "gap_p50", "gap_p99", "tokens_per_s", "generation_time"):
+            values = [r[key] for r in recent if r.get(key) is not None]
+            summary[key] = {"p50": _round(percentile(values, 50)), "p99": _round(percentile(values, 99))}
+        for name, stats in self.sources.items():
+            summary[name] = stats()
+        return summary
+
+    def start_server(self, port, host="127.0.0.1"):
+        """GET /metrics: résumé JSON; GET /metrics/recent: derniers tours détaillés."""
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") == "/metrics":
+                    body = recorder.summary()
+                elif self.path.rstrip("/") == "/metrics/recent":
+                    with recorder._lock:
+                        body = list(recorder.recent)
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        print("Metriques sur http://{}:{}/metrics".format(host, port))
+        return server
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Clients Ollama avec connexions HTTP persistantes, keep_alive et préchauffage du modèle."""
+
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from pepper_config import get_section
+
+DEFAULT_URL = "http://localhost:11434/api/generate"
+DEFAULT_MODEL = "gemma2:9b"
+DEFAULT_TIMEOUT = 30
+DEFAULT_KEEP_ALIVE = "30m"
+DEFAULT_WARMUP_INTERVAL = 240  # secondes d'inactivité avant de repréchauffer le modèle
+DEFAULT_POOL_SIZE = 4
+
+class OllamaError(Exception):
+    pass
+
+class BaseOllamaClient(object):
+    """Paramètres communs aux clients synchrone et asyncio."""
+
+    def __init__(self, url=DEFAULT_URL, model=DEFAULT_MODEL, timeout=DEFAULT_TIMEOUT,
+                 keep_alive=DEFAULT_KEEP_ALIVE, warmup_interval=DEFAULT_WARMUP_INTERVAL,
+                 pool_size=DEFAULT_POOL_SIZE):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.warmup_interval = warmup_interval
+        self.warmup_prompt = ""
+        self.pool_size = pool_size
+
+        self.last_activity = time.time()
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config=None, name="gemma2"):
+        """Construit le client à partir d'une section de config.json ("gemma2" par défaut)."""
+        return cls.from_section(get_section(name, config))
+
+    @classmethod
+    def from_section(cls, section):
+        return cls(url=section.get("url", DEFAULT_URL),
+                   model=section.get("model", DEFAULT_MODEL),
+                   timeout=section.get("timeout", DEFAULT_TIMEOUT),
+                   keep_alive=section.get("keep_alive", DEFAULT_KEEP_ALIVE),
+                   warmup_interval=section.get("warmup_interval", DEFAULT_WARMUP_INTERVAL))
+
+    def build_payload(self, prompt, options=None, stream=True):
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": options or {}
+        }
+
+    def build_chat_payload(self, messages, options=None, stream=True):
+        return {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": options or {}
+        }
+
+    def build_embed_payload(self, texts):
+        """Requête /api/embed: un vecteur par texte, dans l'ordre."""
+        return {
+            "model": self.model,
+            "input": texts,
+            "keep_alive": self.keep_alive
+        }
+
+    def is_chat(self):
+        return self.url.rstrip("/").endswith("/api/chat")
+
+    def is_embed(self):
+        return self.url.rstrip("/").endswith("/api/embed")
+
+    def build_warmup_payload(self, prompt=None):
+        """Même forme de requête que les réponses, pour que le préfixe mis en cache serve ensuite."""
+        prompt = self.warmup_prompt if prompt is None else prompt
+        if self.is_embed():
+            # Un modèle d'embedding n'a pas de préfixe: un texte court suffit à le charger
+            return self.build_embed_payload([prompt or u"bonjour"])
+        if self.is_chat():
+            return self.build_chat_payload([{"role": "system", "content": prompt}], {"num_predict": 1}, stream=False)
+        return self.build_payload(prompt, {"num_predict": 1}, stream=False)
+
+    def is_idle(self):
+        with self._lock:
+            return self._active == 0 and time.time() - self.last_activity >= self.warmup_interval
+
+    def _begin(self):
+        with self._lock:
+            self._active += 1
+            self.last_activity = time.time()
+
+    def _end(self):
+        with self._lock:
+            self._active -= 1
+            self.last_activity = time.time()
+
+class OllamaClient(BaseOllamaClient):
+    """Client synchrone, pour construire l'index des embeddings (llm.retrieval) hors du pipeline."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def embed(self, texts):
+        """Embeddings des textes (self.url doit pointer sur /api/embed)."""
+        response = self.session.post(self.url, json=self.build_embed_payload(texts), timeout=self.timeout)
+        if response.status_code != 200:
+            raise OllamaError("HTTP {}".format(response.status_code))
+        return response.json()["embeddings"]
+
+    def close(self):
+        self.session.close()
+
+class AsyncOllamaClient(BaseOllamaClient):
+    """Version asyncio: annuler la tâche qui consomme le flux ferme la connexion et arrête Ollama."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(max_connections=self.pool_size,
+                                max_keepalive_connections=self.pool_size))
+        self._warmer = None
+
+    async def stream_json(self, payload, url=None, trace=None):
+        """Renvoie chaque message JSON du flux, y compris le dernier ("done") et ses compteurs."""
+        self._begin()
+        try:
+            async with self.client.stream("POST", url or self.url, json=payload,
+                                          extensions={"trace": trace} if trace else None) as response:
+                if response.status_code != 200:
+                    raise OllamaError("HTTP {}".format(response.status_code))
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except ValueError:
+                        continue
+                    yield data
+                    if data.get('done'):
+                        break
+        finally:
+            self._end()
+
+    async def embed(self, texts):
+        """Embeddings des textes (self.url doit pointer sur /api/embed)."""
+        self._begin()
+        try:
+            response = await self.client.post(self.url, json=self.build_embed_payload(texts))
+        finally:
+            self._end()
+        if response.status_code != 200:
+            raise OllamaError("HTTP {}".format(response.status_code))
+        return response.json()["embeddings"]
+
+    async def warm_up(self, prompt=None):
+        """Génération d'un seul token (ou un embedding): charge le modèle et garde le préfixe du prompt en cache."""
+        start = time.time()
+        self._begin()
+        try:
+            response = await self.client.post(self.url, json=self.build_warmup_payload(prompt),
+                                              timeout=max(self.timeout, 120))
+            ok = response.status_code == 200
+        except httpx.HTTPError as e:
+            print("Prechauffage {} impossible: {}".format(self.model, e))
+            ok = False
+        finally:
+            self._end()
+        if ok:
+            print("Modele {} prechauffe en {:.1f}s".format(self.model, time.time() - start))
+        return ok
+
+    def start_warmer(self, prompt=None):
+        """Préchauffe tout de suite, puis à chaque période d'inactivité du robot."""
+        if prompt is not None:
+            self.warmup_prompt = prompt
+        if not self._warmer:
+            self._warmer = asyncio.ensure_future(self._warm_loop())
+
+    def stop_warmer(self):
+        if self._warmer:
+            self._warmer.cancel()
+            self._warmer = None
+
+    async def close(self):
+        self.stop_warmer()
+        await self.client.aclose()
+
+    async def _warm_loop(self):
+        await self.warm_up()
+        if not self.warmup_interval:
+            return
+        while True:
+            await asyncio.sleep(min(self.warmup_interval, 10))
+            if self.is_idle():
+                await self.warm_up()
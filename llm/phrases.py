@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Phrases toutes faites dites par le robot sans appel au modèle (Python 2 et 3).
+
+Relances quand la transcription est inutilisable et phrases d'attente quand
+la réponse tarde. Le lecteur TTS garde leur audio en cache dès le démarrage
+(pepper_tts_handler.PhraseCache).
+"""
+
+# Relances quand la transcription est inutilisable, de plus en plus explicites
+REPROMPTS = [
+    u"Je n'ai pas compris, peux-tu répéter ?",
+    u"Désolé, je n’ai pas compris. Pourrais-tu répéter encore ?",
+    u"Aujourd'hui j'ai des difficultés à comprendre, désolé.",
+]
+REPROMPT_AGAIN = u"Peux-tu répéter cela ?"
+# Phrases d'attente quand la réponse tarde (gemma2_pipeline.filler_after_deadline)
+FILLERS = [
+    u"Hmm, laisse-moi réfléchir…",
+    u"Bonne question…",
+    u"Voyons voir…",
+    u"Attends, je réfléchis…",
+]
+
+def reprompt(misunderstandings):
+    """Relance pour la n-ième incompréhension consécutive (à partir de 1)."""
+    if 1 <= misunderstandings <= len(REPROMPTS):
+        return REPROMPTS[misunderstandings - 1]
+    return REPROMPT_AGAIN
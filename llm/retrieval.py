@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Recherche des informations du lieu à ajouter à la question, avant l'appel au modèle.
+
+Les passages de knowledge.txt (séparés par une ligne vide) sont encodés
+une fois pour toutes par un modèle d'embedding d'Ollama. La matrice
+normalisée est enregistrée dans un fichier .npy lu en mémoire partagée
+(mmap), et les passages dans un fichier JSON à côté. À chaque question,
+seuls les meilleurs passages (produit scalaire, top-k) sont ajoutés au
+message de l'utilisateur: le prompt système reste court et identique,
+donc toujours en cache côté serveur.
+
+Construction de l'index:
+    python3 -m llm.retrieval [--source knowledge.txt] [--query "où est l'accueil ?"]
+"""
+
+import codecs
+import json
+import os
+import time
+from optparse import OptionParser
+
+from llm.ollama import DEFAULT_WARMUP_INTERVAL, AsyncOllamaClient, OllamaClient
+from pepper_config import get_section
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_SOURCE = "knowledge.txt"
+DEFAULT_INDEX = "knowledge.npy"
+DEFAULT_URL = "http://localhost:11434/api/embed"
+DEFAULT_MODEL = "nomic-embed-text"
+DEFAULT_TOP_K = 3
+DEFAULT_MIN_SCORE = 0.35
+BUILD_BATCH = 32
+
+CONTEXT_HEADER = u"Informations sur le lieu (à utiliser seulement si elles répondent à la question) :"
+
+def passages_path(index_path):
+    return os.path.splitext(index_path)[0] + ".json"
+
+def load_passages(path):
+    """Passages d'un fichier ou de tous les .txt d'un dossier; un passage par paragraphe."""
+    paths = [path]
+    if os.path.isdir(path):
+        paths = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".txt")]
+    passages = []
+    for p in paths:
+        with codecs.open(p, "r", encoding="utf-8") as f:
+            lines = [l.rstrip() for l in f if not l.startswith("#")]
+        for block in u"\n".join(lines).split(u"\n\n"):
+            block = u" ".join(block.split())
+            if block:
+                passages.append(block)
+    return passages
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def build_index(source, index_path, client):
+    """Encode les passages et écrit l'index (.npy) et les passages (.json)."""
+    passages = load_passages(source)
+    if not passages:
+        raise ValueError("Aucun passage dans {}".format(source))
+    vectors = []
+    for i in range(0, len(passages), BUILD_BATCH):
+        vectors.extend(client.embed(passages[i:i + BUILD_BATCH]))
+    matrix = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    np.save(index_path, matrix)
+    with codecs.open(passages_path(index_path), "w", encoding="utf-8") as f:
+        json.dump({"model": client.model, "dim": matrix.shape[1], "passages": passages},
+                  f, ensure_ascii=False, indent=1)
+    return matrix.shape
+
+class Retriever(object):
+    """Index en lecture seule: search() sur un vecteur, retrieve() sur une question."""
+
+    def __init__(self, index_path, client, top_k=DEFAULT_TOP_K, min_score=DEFAULT_MIN_SCORE):
+        self.client = client
+        self.top_k = top_k
+        self.min_score = min_score
+        # mmap: la matrice n'est pas copiée en mémoire, les pages sont lues à la demande
+        self.matrix = np.load(index_path, mmap_mode="r")
+        with codecs.open(passages_path(index_path), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.passages = meta["passages"]
+        if meta.get("model") != client.model:
+            print("WARNING: index construit avec {}, requetes avec {}".format(meta.get("model"), client.model))
+        if len(self.passages) != self.matrix.shape[0]:
+            raise ValueError("Index et passages incoherents: {}".format(index_path))
+
+    @classmethod
+    def from_config(cls, config=None, client_class=AsyncOllamaClient):
+        """Renvoie None (sans étape de recherche) si l'index n'est pas construit."""
+        section = get_section("retrieval", config)
+        index_path = section.get("index", DEFAULT_INDEX)
+        if not section.get("enabled", True):
+            return None
+        if np is None:
+            print("WARNING: numpy absent, recherche d'informations desactivee")
+            return None
+        if not os.path.isfile(index_path):
+            print("WARNING: index introuvable ({}), lancer: python3 -m llm.retrieval".format(index_path))
+            return None
+        return cls(index_path, embedding_client(section, client_class),
+                   top_k=section.get("top_k", DEFAULT_TOP_K),
+                   min_score=section.get("min_score", DEFAULT_MIN_SCORE))
+
+    def search(self, vector):
+        """Renvoie [(score, passage)] du meilleur au moins bon, au-dessus de min_score."""
+        query = normalize_rows(np.asarray(vector, dtype=np.float32))
+        scores = np.dot(self.matrix, query)
+        k = min(self.top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.passages[i]) for i in top if scores[i] >= self.min_score]
+
+    def start_warmer(self):
+        """Charge le modèle d'embedding tout de suite et après chaque période d'inactivité:
+        chargé à froid, il dépasserait le délai de la recherche."""
+        self.client.start_warmer()
+
+    async def retrieve(self, question):
+        vectors = await self.client.embed([question])
+        return self.search(vectors[0])
+
+    async def close(self):
+        await self.client.close()
+
+def embedding_client(section, client_class):
+    return client_class(url=section.get("url", DEFAULT_URL), model=section.get("model", DEFAULT_MODEL),
+                        timeout=section.get("timeout", 10), keep_alive=section.get("keep_alive", "30m"),
+                        warmup_interval=section.get("warmup_interval", DEFAULT_WARMUP_INTERVAL))
+
+def with_context(question, passages):
+    """Message utilisateur: les passages trouvés puis la question."""
+    if not passages:
+        return question
+    lines = [CONTEXT_HEADER] + [u"- " + p for _, p in passages]
+    return u"\n".join(lines) + u"\n\n" + question
+
+parser = OptionParser()
+parser.add_option("--source", dest="source", help="Fichier ou dossier des informations du lieu.")
+parser.add_option("--index", dest="index", help="Fichier .npy de l'index.")
+parser.add_option("--query", dest="query", help="Question de test après la construction.")
+
+if __name__ == "__main__":
+    section = get_section("retrieval")
+    parser.set_defaults(source=section.get("source", DEFAULT_SOURCE), index=section.get("index", DEFAULT_INDEX))
+    (opts, args_) = parser.parse_args()
+    if np is None:
+        raise SystemExit("numpy est necessaire pour construire l'index")
+    client = embedding_client(section, OllamaClient)
+    start = time.time()
+    shape = build_index(opts.source, opts.index, client)
+    print("Index {}: {} passages, dimension {} ({:.1f}s)".format(opts.index, shape[0], shape[1], time.time() - start))
+    if opts.query:
+        retriever = Retriever(opts.index, client, top_k=section.get("top_k", DEFAULT_TOP_K), min_score=-1.0)
+        for score, passage in retriever.search(client.embed([opts.query])[0]):
+            print("{:.3f}  {}".format(score, passage))
+    client.close()
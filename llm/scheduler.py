@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Partage d'une seule instance Ollama entre plusieurs robots.
+
+Le nombre de générations simultanées est borné (au-delà, Ollama les met
+en file ou les ralentit toutes). Quand une place se libère, elle va
+d'abord aux tours confirmés plutôt qu'aux tours spéculatifs, puis au
+robot qui a le moins de générations en cours, puis au plus ancien en
+attente: un robot bavard ne retarde pas le premier token des autres.
+"""
+
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+DEFAULT_MAX_CONCURRENT = 2
+
+class FairScheduler(object):
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self.running = 0
+        self.active = {}
+        self.granted = 0
+        self.queued = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, session, speculative=False):
+        """async with scheduler.slot(robot): ... ; renvoie le temps passé en attente."""
+        start = time.time()
+        await self.acquire(session, speculative)
+        try:
+            yield time.time() - start
+        finally:
+            self.release(session)
+
+    async def acquire(self, session, speculative=False):
+        if self.running < self.max_concurrent and not self._waiters:
+            self._grant(session)
+            return
+        self.queued += 1
+        entry = (bool(speculative), next(self._seq), session, asyncio.get_event_loop().create_future())
+        self._waiters.append(entry)
+        try:
+            await entry[3]
+        except asyncio.CancelledError:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+            elif entry[3].done() and not entry[3].cancelled():
+                # Place accordée pendant l'annulation: on la rend
+                self.release(session)
+            raise
+
+    def release(self, session):
+        self.running -= 1
+        self.active[session] -= 1
+        if not self.active[session]:
+            del self.active[session]
+        self._wake()
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "running": self.running,
+            "waiting": len(self._waiters),
+            "granted": self.granted,
+            "queued": self.queued,
+        }
+
+    def _grant(self, session):
+        self.running += 1
+        self.granted += 1
+        self.active[session] = self.active.get(session, 0) + 1
+
+    def _wake(self):
+        while self.running < self.max_concurrent and self._waiters:
+            entry = min(self._waiters, key=lambda e: (e[0], self.active.get(e[2], 0), e[1]))
+            self._waiters.remove(entry)
+            if entry[3].done():
+                continue
+            self._grant(entry[2])
+            entry[3].set_result(None)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""Découpage du flux de tokens en morceaux prononçables pour le TTS.
+
+Le premier morceau part dès une frontière de proposition (virgule,
+point-virgule, conjonction) une fois une longueur minimale atteinte, pour
+que Pepper commence à parler au plus tôt. Les suivants sont des phrases
+complètes. Les abréviations ("M.", "Mme."), les initiales ("J. Dupont"),
+les nombres ("3.5", "3,5") et les points de suspension ne coupent pas une
+phrase.
+
+ChunkPacker regroupe ensuite ces morceaux pour le TTS: chaque appel à say
+a un coût fixe (RPC, analyse des balises, choix des gestes), donc les
+phrases courtes sont fusionnées tant que le robot parle encore, et les
+phrases trop longues coupées aux propositions.
+"""
+
+import re
+import time
+
+FIRST_CHUNK_MIN_CHARS = 24
+# Regroupement pour le TTS (réglé avec bench/loadgen et l'écart mesuré entre phrases)
+PACK_TARGET_DURATION = 3.0
+PACK_MAX_CHARS = 180
+CHARS_PER_SECOND = 14.0
+SAY_OVERHEAD = 0.15
+# Le morceau en attente part un peu avant que le robot ait fini de parler
+IDLE_LEAD = 0.3
+
+SENTENCE_END = u".!?…"
+CLAUSE_END = u",;:"
+CLOSING = u"»\"')]"
+
+ABBREVIATIONS = frozenset([
+    u"m", u"mm", u"mme", u"mmes", u"mlle", u"mlles", u"dr", u"pr", u"me", u"mgr",
+    u"st", u"ste", u"cf", u"ex", u"env", u"av", u"apr", u"bd", u"ch", u"tél",
+    u"vol", u"p", u"n", u"no", u"fig", u"c.-à-d", u"j.-c",
+])
+
+CONJUNCTIONS = (u"mais", u"donc", u"car", u"alors", u"puis", u"parce que",
+                u"puisque", u"cependant", u"pourtant", u"sinon", u"ensuite")
+
+# Mots qui commencent une phrase: après "salle B." ils ne sont pas un nom de famille
+SENTENCE_OPENERS = frozenset([
+    u"le", u"la", u"les", u"l", u"un", u"une", u"des", u"du", u"de", u"d", u"ce", u"cet", u"cette", u"ces",
+    u"c", u"ça", u"cela", u"il", u"ils", u"elle", u"elles", u"je", u"j", u"tu", u"on", u"nous", u"vous",
+    u"y", u"en", u"et", u"ou", u"mais", u"puis", u"ensuite", u"alors", u"donc", u"enfin", u"aussi", u"si",
+    u"quand", u"pour", u"par", u"sur", u"dans", u"au", u"aux", u"à", u"a", u"voici", u"voilà", u"oui",
+    u"non", u"merci", u"bonjour", u"bien", u"là", u"ici", u"après", u"avant", u"comme", u"où", u"qui",
+    u"que", u"quel", u"quelle", u"mon", u"ma", u"mes", u"ton", u"ta", u"tes", u"votre", u"vos", u"notre",
+    u"nos", u"son", u"sa", u"ses", u"leur", u"leurs", u"tout", u"toute", u"tous", u"toutes", u"chaque",
+    u"prenez", u"allez", u"suivez", u"tournez", u"continuez", u"n", u"ne", u"pas", u"maintenant",
+    u"aujourd", u"attention", u"désolé", u"heureusement", u"malheureusement",
+])
+
+# Nombre de caractères relus à chaque token: une décision peut dépendre
+# de ce qui suit la ponctuation (espace, majuscule, conjonction ou mot complet).
+LOOKBACK = max(len(w) for w in CONJUNCTIONS + tuple(SENTENCE_OPENERS)) + 4
+
+_WORD_BEFORE = re.compile(u"([\\w.-]+)$", re.UNICODE)
+_WORD_AFTER = re.compile(u"\\s+([^\\W\\d_]+)([\\s\\S]?)", re.UNICODE)
+_CONJUNCTION_AT = re.compile(u"\\s(?:%s)\\s" % u"|".join(CONJUNCTIONS), re.UNICODE | re.IGNORECASE)
+_CLAUSE_CUT = re.compile(u"[%s]\\s+|\\s(?=(?:%s)\\s)" % (CLAUSE_END, u"|".join(CONJUNCTIONS)),
+                         re.UNICODE | re.IGNORECASE)
+
+class ClauseSegmenter(object):
+    """Reçoit les tokens un à un (feed) et rend les morceaux prêts à être dits."""
+
+    def __init__(self, first_chunk_min_chars=FIRST_CHUNK_MIN_CHARS):
+        self.first_chunk_min_chars = first_chunk_min_chars
+        self.reset()
+
+    def reset(self):
+        self.buffer = u""
+        self.chunks_emitted = 0
+        self._scan = 0
+
+    def feed(self, token):
+        """Ajoute un token et renvoie la liste des morceaux complétés."""
+        self.buffer += token
+        chunks = []
+        while True:
+            cut = self._next_boundary()
+            if cut is None:
+                break
+            chunk, self.buffer = self.buffer[:cut].strip(), self.buffer[cut:]
+            self._scan = 0
+            if chunk:
+                chunks.append(chunk)
+                self.chunks_emitted += 1
+        self._scan = max(0, len(self.buffer) - LOOKBACK)
+        return chunks
+
+    def flush(self):
+        """Fin du flux: renvoie le reste du texte."""
+        chunk = self.buffer.strip()
+        self.reset()
+        return [chunk] if chunk else []
+
+    def _next_boundary(self):
+        buf = self.buffer
+        clause_mode = self.chunks_emitted == 0
+        lead = len(buf) - len(buf.lstrip())
+        i = self._scan
+        while i < len(buf) - 1:
+            c = buf[i]
+            if c in SENTENCE_END:
+                if i > 0 and buf[i - 1] in SENTENCE_END:
+                    # Seul le début d'une suite "...", "?!" est examiné
+                    i += 1
+                    continue
+                cut = self._sentence_end(buf, i)
+                if cut is not None:
+                    return cut
+            elif clause_mode and i - lead >= self.first_chunk_min_chars:
+                if c in CLAUSE_END and buf[i + 1].isspace():
+                    return i + 1
+                if c.isspace():
+                    m = _CONJUNCTION_AT.match(buf, i)
+                    if m:
+                        return i
+            i += 1
+        return None
+
+    def _sentence_end(self, buf, i):
+        """Position de coupe si la ponctuation en i termine une phrase, sinon None."""
+        j = i
+        while j < len(buf) and buf[j] in SENTENCE_END:
+            j += 1
+        ellipsis = j - i > 1 or buf[j - 1] == u"…"
+        while j < len(buf) and buf[j] in CLOSING:
+            j += 1
+        # Guillemet fermant français précédé d'une espace: "Bonjour. »"
+        if j + 1 == len(buf) and buf[j] in u" \u00a0":
+            return None
+        if buf[j:j + 2] in (u" »", u"\u00a0»"):
+            j += 2
+        # Il faut voir le caractère suivant: "3.5", "www.pepper.fr" ne coupent pas
+        if j >= len(buf) or not buf[j].isspace():
+            return None
+        if ellipsis:
+            # "Eh bien... je crois" continue la phrase, "Bon... Je crois" non
+            k = j
+            while k < len(buf) and buf[k].isspace():
+                k += 1
+            if k >= len(buf) or not (buf[k].isupper() or buf[k] in u"«\"-"):
+                return None
+        elif buf[i] == u".":
+            m = _WORD_BEFORE.search(buf, 0, i)
+            word = m.group(1) if m else u""
+            if word.lower() in ABBREVIATIONS or (len(word) == 1 and word.isupper() and self._initial(buf, j)):
+                return None
+        return j
+
+    def _initial(self, buf, j):
+        """Une majuscule seule suivie d'une autre initiale ou d'un nom ("J. R. Tolkien", "J. Dupont");
+        vrai aussi tant que le mot suivant n'est pas complet. "Salle B. Ensuite" coupe."""
+        m = _WORD_AFTER.match(buf, j)
+        if not m:
+            return not buf[j:].strip()
+        word, after = m.group(1), m.group(2)
+        if not word[0].isupper():
+            return False
+        if not after:
+            return True
+        if len(word) == 1 and after == u".":
+            return True
+        return word.lower() not in SENTENCE_OPENERS
+
+class SpokenBudget(object):
+    """Limite de ce qui est dit en un tour, en phrases et/ou en caractères (0: sans limite).
+
+    take() compte un morceau et dit s'il peut être prononcé; une fois la
+    limite atteinte, exhausted passe à True et la génération peut s'arrêter.
+    """
+
+    def __init__(self, max_sentences=0, max_chars=0):
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+        self.sentences = 0
+        self.chars = 0
+        self.exhausted = False
+
+    def take(self, chunk):
+        if self.exhausted:
+            return False
+        # Le premier morceau part toujours: mieux vaut trop long que muet
+        if self.max_chars and self.chars and self.chars + len(chunk) > self.max_chars:
+            self.exhausted = True
+            return False
+        self.chars += len(chunk)
+        if chunk.rstrip(CLOSING + u" \u00a0»")[-1:] in SENTENCE_END:
+            self.sentences += 1
+        if (self.max_sentences and self.sentences >= self.max_sentences) or \
+                (self.max_chars and self.chars >= self.max_chars):
+            self.exhausted = True
+        return True
+
+def split_clauses(chunk, max_chars=PACK_MAX_CHARS):
+    """Coupe un morceau trop long à la dernière proposition qui tient, sinon au dernier espace."""
+    parts = []
+    while max_chars and len(chunk) > max_chars:
+        cuts = [m.end() for m in _CLAUSE_CUT.finditer(chunk, 0, max_chars) if m.end() >= max_chars // 3]
+        cut = cuts[-1] if cuts else chunk.rfind(u" ", 0, max_chars)
+        if cut <= 0:
+            break
+        parts.append(chunk[:cut].strip())
+        chunk = chunk[cut:].strip()
+    parts.append(chunk)
+    return parts
+
+class ChunkPacker(object):
+    """Regroupe les morceaux pour que chaque appel au TTS porte assez de texte.
+
+    Le premier morceau part tel quel, pour que le robot commence tôt. Les
+    suivants sont fusionnés jusqu'à target_duration secondes de parole
+    tant que le TTS est occupé par ce qu'il a déjà reçu (durée estimée au
+    débit chars_per_second, plus say_overhead par appel); ce qui attend
+    part dès que le TTS va se taire (due). target_duration=0 désactive la
+    fusion.
+    """
+
+    def __init__(self, target_duration=PACK_TARGET_DURATION, max_chars=PACK_MAX_CHARS,
+                 chars_per_second=CHARS_PER_SECOND, say_overhead=SAY_OVERHEAD, idle_lead=IDLE_LEAD):
+        self.target_duration = target_duration
+        self.max_chars = max_chars
+        self.chars_per_second = chars_per_second
+        self.say_overhead = say_overhead
+        self.idle_lead = idle_lead
+        self.held = []
+        self.busy_until = 0.0
+        self.emitted = 0
+
+    def duration(self, text):
+        return len(text) / float(self.chars_per_second)
+
+    def add(self, chunk, now=None):
+        """Ajoute un morceau; renvoie ceux à envoyer au TTS maintenant."""
+        now = now or time.time()
+        ready = []
+        for part in split_clauses(chunk, self.max_chars):
+            if not self.emitted:
+                self.held.append(part)
+                ready.append(self._emit(now))
+                continue
+            if self.held and len(self._text()) + 1 + len(part) > self.max_chars:
+                ready.append(self._emit(now))
+            self.held.append(part)
+            if self.duration(self._text()) >= self.target_duration:
+                ready.append(self._emit(now))
+        return ready + self.due(now)
+
+    def next_due(self):
+        """Instant où le texte en attente devra partir, None s'il n'y en a pas."""
+        return self.busy_until - self.idle_lead if self.held else None
+
+    def due(self, now=None):
+        """Le texte en attente, si le TTS va bientôt avoir fini."""
+        now = now or time.time()
+        if self.held and now >= self.busy_until - self.idle_lead:
+            return [self._emit(now)]
+        return []
+
+    def flush(self, now=None):
+        return [self._emit(now or time.time())] if self.held else []
+
+    def _text(self):
+        return u" ".join(self.held)
+
+    def _emit(self, now):
+        text, self.held = self._text(), []
+        self.busy_until = max(self.busy_until, now) + self.say_overhead + self.duration(text)
+        self.emitted += 1
+        return text
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Normalisation des transcriptions et comparaison approximative (Python 2 et 3).
+
+La similarité utilise Levenshtein.ratio (python-Levenshtein-wheels-0.13.1,
+à installer avec pip) et se replie sur difflib s'il n'est pas compilé.
+"""
+
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+try:
+    from Levenshtein import ratio as _levenshtein_ratio
+except ImportError:
+    _levenshtein_ratio = None
+
+_NON_WORD = re.compile(u"[^\\w]+", re.UNICODE)
+
+def normalize_text(text):
+    """Minuscules, sans accents ni ponctuation: "Où sont les toilettes ?" -> "ou sont les toilettes"."""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", "ignore")
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = u"".join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD.sub(u" ", text).replace(u"_", u" ").strip()
+
+def similarity(a, b):
+    """Ratio de similarité entre 0 et 1 de deux textes déjà normalisés."""
+    if _levenshtein_ratio is not None:
+        return _levenshtein_ratio(a, b)
+    return SequenceMatcher(None, a, b).ratio()
+
+def max_similarity(len_a, len_b):
+    """Borne haute du ratio d'après les longueurs seules, pour écarter vite un candidat."""
+    total = len_a + len_b
+    return 2.0 * min(len_a, len_b) / total if total else 1.0
+
+def best_match(text, candidates, threshold):
+    """Renvoie (candidat, score) le plus proche au-dessus du seuil, sinon (None, 0)."""
+    best, best_score = None, 0.0
+    for candidate in candidates:
+        if max_similarity(len(text), len(candidate)) < max(threshold, best_score):
+            continue
+        score = similarity(text, candidate)
+        if score >= threshold and score > best_score:
+            best, best_score = candidate, score
+    return best, best_score
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Mise en forme du texte pour la synthèse vocale française de Pepper (Python 2 et 3).
+
+normalize_for_tts() s'applique une fois à chaque morceau de réponse, avant
+l'envoi au lecteur TTS: Unicode NFC, guillemets et apostrophes
+typographiques, heures, ordinaux, unités et monnaies, nombres décimaux,
+abréviations, et retrait de la mise en forme Markdown et des emojis. Les
+accents sont conservés. speech_bytes() donne ensuite les octets UTF-8
+attendus par ALAnimatedSpeech.say et ALTextToSpeech.
+"""
+
+import re
+import unicodedata
+
+_UNITS = (u"zéro un deux trois quatre cinq six sept huit neuf dix onze douze "
+          u"treize quatorze quinze seize").split()
+_TENS = {2: u"vingt", 3: u"trente", 4: u"quarante", 5: u"cinquante", 6: u"soixante"}
+
+# Caractères remplacés un à un (table de str.translate)
+_CHARACTERS = {
+    u"’": u"'", u"‘": u"'", u"‛": u"'", u"ʼ": u"'", u"`": u"'",
+    u"“": u"", u"”": u"", u"„": u"", u"«": u"", u"»": u"", u'"': u"",
+    u"…": u"...", u"–": u",", u"—": u",",
+    u"\u00a0": u" ", u"\u202f": u" ", u"\u2009": u" ", u"\u200b": u"",
+    # Liants et sélecteurs de variante des emojis composés
+    u"\u200d": u"", u"\ufe0f": u"",
+    u"*": u"", u"#": u"", u"_": u" ", u"&": u" et ",
+}
+_TRANSLATION = dict((ord(k), v) for k, v in _CHARACTERS.items())
+# Couleurs de peau des emojis (catégorie Sk, pas So); par code pour les Python 2 à UTF-16
+_TRANSLATION.update((code, u"") for code in range(0x1F3FB, 0x1F400))
+
+# Unités et monnaies après un nombre: (singulier, pluriel)
+_UNIT_NAMES = {
+    u"km/h": (u"kilomètre heure", u"kilomètres heure"),
+    u"km": (u"kilomètre", u"kilomètres"),
+    u"cm": (u"centimètre", u"centimètres"),
+    u"mm": (u"millimètre", u"millimètres"),
+    u"m": (u"mètre", u"mètres"),
+    u"kg": (u"kilo", u"kilos"),
+    u"g": (u"gramme", u"grammes"),
+    u"ml": (u"millilitre", u"millilitres"),
+    u"l": (u"litre", u"litres"),
+    u"L": (u"litre", u"litres"),
+    u"min": (u"minute", u"minutes"),
+    u"°C": (u"degré", u"degrés"),
+    u"°": (u"degré", u"degrés"),
+    u"€": (u"euro", u"euros"),
+    u"$": (u"dollar", u"dollars"),
+    u"%": (u"pour cent", u"pour cent"),
+}
+
+_ABBREVIATIONS = [(re.compile(p, re.UNICODE), r) for p, r in [
+    (u"\\bM\\.(?=\\s+[A-ZÀ-Ý])", u"Monsieur"),
+    (u"\\bMM\\.(?=\\s+[A-ZÀ-Ý])", u"Messieurs"),
+    (u"\\bMmes\\b\\.?", u"Mesdames"),
+    (u"\\bMme\\b\\.?", u"Madame"),
+    (u"\\bMlle\\b\\.?", u"Mademoiselle"),
+    (u"\\bDr\\b\\.?", u"Docteur"),
+    (u"\\bPr\\b\\.?", u"Professeur"),
+    (u"\\bSt(?=-)", u"Saint"),
+    (u"\\bSte(?=-)", u"Sainte"),
+    (u"\\betc\\.(?=\\s+[A-ZÀ-Ý]|\\s*$)", u"et cetera."),
+    (u"\\betc\\.", u"et cetera"),
+    (u"\\benv\\.", u"environ"),
+    (u"\\bc\\.-à-d\\.?", u"c'est-à-dire"),
+    (u"\\bp\\.\\s?ex\\.", u"par exemple"),
+    (u"\\b[nN]°\\s?", u"numéro "),
+    (u"\\bav\\.", u"avenue"),
+    (u"\\bbd\\b\\.?", u"boulevard"),
+    (u"\\btél\\.", u"téléphone"),
+    (u"\\bRDC\\b", u"rez-de-chaussée"),
+]]
+
+_NUMBER = u"\\d+(?:[.,]\\d+)?"
+_THOUSANDS = re.compile(u"(?<=\\d) (?=\\d{3}\\b)", re.UNICODE)
+_TIME = re.compile(u"\\b(\\d{1,2})(?:\\s?[hH]|:(?=\\d{2}))(\\d{2})?\\b", re.UNICODE)
+_ORDINAL = re.compile(u"\\b(\\d+)(er|re|ère|e|ème|ᵉ)\\b", re.UNICODE)
+# L'unité est suivie d'un blanc, d'une ponctuation ou de la fin: "2024 l'entreprise" n'a pas d'unité
+_UNIT = re.compile(u"(%s)\\s?(%s)(?=[\\s.,;:!?)]|$)" % (_NUMBER, u"|".join(
+    re.escape(u) for u in sorted(_UNIT_NAMES, key=len, reverse=True))), re.UNICODE)
+# Intervalle avec un tiret: "9h–18h" -> "9h à 18h"
+_RANGE = re.compile(u"(?<=\\w)\\s?[–—]\\s?(?=\\d)", re.UNICODE)
+_CURRENCY_BEFORE = re.compile(u"([€$])\\s?(%s)" % _NUMBER, re.UNICODE)
+_DECIMAL = re.compile(u"\\b(\\d+)[.,](\\d+)\\b", re.UNICODE)
+_BULLET = re.compile(u"^\\s*(?:[-•]|\\d+\\.)\\s+", re.UNICODE | re.MULTILINE)
+_CONTROL = re.compile(u"[\\x00-\\x1f\\x7f]+", re.UNICODE)
+_SPACES = re.compile(u"\\s+", re.UNICODE)
+_SPACE_BEFORE_COMMA = re.compile(u"\\s+,", re.UNICODE)
+# Symboles gardés malgré leur catégorie Unicode (So): ils sont lus par les tables ci-dessus
+_KEPT_SYMBOLS = frozenset(u"°€$%")
+# Emojis et pictogrammes; "Cn": les emojis récents sont inconnus de l'unicodedata de Python 2
+_DROPPED_CATEGORIES = ("So", "Cs", "Co", "Cn")
+
+def _below_100(n):
+    if n < 17:
+        return _UNITS[n]
+    if n < 20:
+        return u"dix-" + _UNITS[n - 10]
+    tens, unit = divmod(n, 10)
+    if tens in (7, 9):
+        base, rest = (u"soixante", n - 60) if tens == 7 else (u"quatre-vingt", n - 80)
+        return base + (u" et " if rest == 11 and tens == 7 else u"-") + _below_100(rest)
+    if tens == 8:
+        return u"quatre-vingt-" + _UNITS[unit] if unit else u"quatre-vingts"
+    if unit == 1:
+        return _TENS[tens] + u" et un"
+    return _TENS[tens] + (u"-" + _UNITS[unit] if unit else u"")
+
+def _below_1000(n):
+    hundreds, rest = divmod(n, 100)
+    if not hundreds:
+        return _below_100(n)
+    head = u"cent" if hundreds == 1 else _UNITS[hundreds] + u" cent"
+    if not rest:
+        return head + (u"s" if hundreds > 1 else u"")
+    return head + u" " + _below_100(rest)
+
+def number_words(n):
+    """Nombre entier en toutes lettres: 81 -> "quatre-vingt-un"."""
+    if n < 0:
+        return u"moins " + number_words(-n)
+    if n < 1000:
+        return _below_1000(n)
+    for value, name in ((10 ** 9, u"milliard"), (10 ** 6, u"million"), (1000, u"mille")):
+        if n >= value:
+            high, rest = divmod(n, value)
+            if value == 1000:
+                # "deux cent mille", "quatre-vingt mille": pas de s devant mille
+                head = u"mille" if high == 1 else re.sub(u"(cent|vingt)s$", u"\\1", number_words(high)) + u" mille"
+            else:
+                head = number_words(high) + u" " + name + (u"s" if high > 1 else u"")
+            return head + (u" " + number_words(rest) if rest else u"")
+
+def ordinal_words(n, feminine=False):
+    """Ordinal en toutes lettres: 1 -> "premier", 21 -> "vingt et unième"."""
+    if n == 1:
+        return u"première" if feminine else u"premier"
+    words = number_words(n)
+    if words.endswith(u"cinq"):
+        return words + u"uième"
+    if words.endswith(u"neuf"):
+        return words[:-1] + u"vième"
+    if words.endswith(u"s") and (words.endswith(u"cents") or words.endswith(u"vingts")):
+        words = words[:-1]
+    if words.endswith(u"e"):
+        words = words[:-1]
+    return words + u"ième"
+
+def _plural(number):
+    return float(number.replace(u",", u".")) >= 2
+
+def _say_time(match):
+    hours, minutes = int(match.group(1)), match.group(2)
+    if hours > 24 or (minutes and int(minutes) > 59):
+        return match.group(0)
+    text = u"{} heure{}".format(hours, u"s" if hours > 1 else u"")
+    if minutes and int(minutes):
+        text += u" {}".format(int(minutes))
+    return text
+
+def _say_ordinal(match):
+    return ordinal_words(int(match.group(1)), match.group(2) in (u"re", u"ère"))
+
+def _say_amount(number, unit):
+    name = _UNIT_NAMES[unit][_plural(number)]
+    units, _, cents = number.replace(u".", u",").partition(u",")
+    if unit in u"€$" and len(cents) == 2:
+        # "3,50 €" -> "3 euros 50"
+        return u"{} {}{}".format(units, name, u" {}".format(int(cents)) if int(cents) else u"")
+    return u"{} {}".format(number, name)
+
+def _say_unit(match):
+    return _say_amount(match.group(1), match.group(2))
+
+def _say_currency_before(match):
+    return _say_amount(match.group(2), match.group(1))
+
+def _say_decimal(match):
+    return u"{} virgule {}".format(match.group(1), match.group(2))
+
+def as_text(text):
+    """Texte Unicode NFC sans caractères de contrôle (octets supposés en UTF-8)."""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", "replace")
+    return _CONTROL.sub(u" ", unicodedata.normalize("NFC", text)).strip()
+
+def normalize_for_tts(text):
+    """Morceau de réponse prêt à être dit: accents conservés, symboles et abréviations en mots."""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", "replace")
+    # Les puces se reconnaissent en début de ligne, avant que les retours à la ligne disparaissent
+    text = _RANGE.sub(u" à ", as_text(_BULLET.sub(u"", text))).translate(_TRANSLATION)
+    text = u"".join(c for c in text if c in _KEPT_SYMBOLS or unicodedata.category(c) not in _DROPPED_CATEGORIES)
+    text = _THOUSANDS.sub(u"", text)
+    text = _TIME.sub(_say_time, text)
+    text = _ORDINAL.sub(_say_ordinal, text)
+    text = _CURRENCY_BEFORE.sub(_say_currency_before, text)
+    text = _UNIT.sub(_say_unit, text)
+    text = _DECIMAL.sub(_say_decimal, text)
+    for pattern, replacement in _ABBREVIATIONS:
+        text = pattern.sub(replacement, text)
+    text = _SPACE_BEFORE_COMMA.sub(u",", _SPACES.sub(u" ", text))
+    return text.strip(u" ,")
+
+def speech_bytes(text):
+    """Octets UTF-8 pour ALAnimatedSpeech.say et ALTextToSpeech."""
+    return as_text(text).encode("utf-8")
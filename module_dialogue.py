@@ -24,6 +24,13 @@ import sys, os
 import codecs
 from naoqi import ALProxy
 from oaichat.oaiclient import OaiClient
+from pepper_actuators import Actuators
+from pepper_bringup import BringUp
+from pepper_config import get_section
+from pepper_proxies import ProxyManager
+from llm.intents import IntentRouter
+from llm.phrases import reprompt
+from llm.tts_text import normalize_for_tts, speech_bytes
 
 # --- Robust UTF-8 decoder ---
 def safe_decode(s):
@@ -48,6 +55,11 @@ participantId = raw_input('Participant ID: ')
 
 chatbot = OaiClient(user=participantId)
 chatbot.reset()
+intentRouter = IntentRouter()
+# Proxies reconnectés après une coupure; posture et volume passent par les actionneurs
+# (ordres asynchrones, sans doublons). Créés dans main(), une fois le broker lancé.
+proxies = None
+actuators = None
 
 class DialogueModule(naoqi.ALModule):
     """
@@ -67,20 +79,23 @@ class DialogueModule(naoqi.ALModule):
         print(u"INF: ReceiverModule.__del__: cleaning everything")
         self.stop()
 
-    def start(self):
-        self.configureSpeechRecognition()
+    def start(self, bringup):
+        # Étapes lancées par main(): la reconnaissance se configure pendant la mise en posture
+        bringup.check("reconnaissance vocale")
         self.memory = naoqi.ALProxy("ALMemory", self.strNaoIp, ROBOT_PORT)
         self.memory.subscribeToEvent("SpeechRecognition", self.getName(), "processRemote")
         print(u"INF: ReceiverModule: started!")
-        try:
-            self.posture = ALProxy("ALRobotPosture", self.strNaoIp, ROBOT_PORT)
-            self.aup = ALProxy("ALAnimatedSpeech", self.strNaoIp, ROBOT_PORT)
-        except RuntimeError:
-            print(u"Can't connect to Naoqi at ip \"%s\" on port %d.\nPlease check your script arguments. Run with -h option for help." % (self.strNaoIp, ROBOT_PORT))
+        self.aup = proxies.get("ALAnimatedSpeech")
+        # Parole et écoute (calibration comprise) une fois le robot debout, moteurs au repos
+        bringup.wait("volume", "posture")
         if START_PROMPT:
-            answer = safe_decode(chatbot.respond(START_PROMPT))
-            self.speak(answer)
+            # Phrase d'accueil demandée au LLM pendant la mise en route
+            answer = bringup.wait("phrase d'accueil")
+            if answer:
+                bringup.report("premiere phrase")
+                self.speak(answer)
         self.listen(True)
+        bringup.report()
         print(u'Listening...')
 
     def stop(self):
@@ -119,28 +134,35 @@ class DialogueModule(naoqi.ALModule):
             self.speechRecognition.pause()
 
     def speak(self, text):
-        # Always encode as UTF-8 bytes before say()
-        if isinstance(text, unicode):
-            text = text.encode('utf-8')
-        self.aup.say(text)
+        # Mise en forme française puis octets UTF-8 pour say()
+        text = speech_bytes(normalize_for_tts(safe_decode(text)))
+        try:
+            self.aup.say(text)
+        except RuntimeError, err:
+            # Robot injoignable: la reconnexion se fait en arrière-plan, l'écoute reprend
+            print(u"ERR: parole impossible: %s" % safe_decode(err))
 
     def processRemote(self, signalName, message):
         message = safe_decode(message)
         self.log.write(u'INP: ' + message + u'\n')
-        if message == u'error':
-            return
+        # Transcription vide ou en échec: relance au lieu de se taire
+        if not message.strip():
+            message = u'error'
         self.listen(False)
         print(u"USER:\n" + message)
+        # Ordres de mouvement: exécution immédiate, sans passer par ChatGPT
+        intent = intentRouter.match(message) if message != u'error' else None
+        if intent:
+            answer = intent.ack()
+            print(u'COMMANDE DIRECTE: ' + intent.name)
+            self.log.write(u'ANS: ' + answer + u'\n')
+            actuators.posture(intent.posture, 1.0)
+            self.speak(answer)
+            self.listen(True)
+            return
         if message == u'error':
             self.misunderstandings += 1
-            if self.misunderstandings == 1:
-                answer = u"Je n'ai pas compris, peux-tu répéter ?"
-            elif self.misunderstandings == 2:
-                answer = u"Désolé, je n’ai pas compris. Pourrais-tu répéter encore ?"
-            elif self.misunderstandings == 3:
-                answer = u"Aujourd'hui j'ai des difficultés à comprendre, désolé."
-            else:
-                answer = u"Peux-tu répéter cela ?"
+            answer = reprompt(self.misunderstandings)
             print(u'ERREUR, REPONSE PAR DEFAUT:\n' + answer)
         else:
             self.misunderstandings = 0
@@ -154,19 +176,37 @@ class DialogueModule(naoqi.ALModule):
     def react(self, s):
         s = safe_decode(s)
         if re.match(u".*je.*m.*asseoir.*", s):
-            self.posture.goToPosture("Sit", 1.0)
+            actuators.posture("Sit", 1.0)
         elif re.match(u".*je.*me l[e|ai]ve.*", s):
-            self.posture.goToPosture("Stand", 1.0)
+            actuators.posture("Stand", 1.0)
         elif re.match(u".*je.*m.*allonge.*", s):
-            self.posture.goToPosture("LyingBack", 1.0)
+            actuators.posture("LyingBack", 1.0)
+
+def disable_autonomous_life():
+    # Toujours DESACTIVER AutonomousLife (elle reprendrait la posture et la parole)
+    actuators.autonomous_life('disabled')
+    actuators.join('autonomous_life')
+
+def stand():
+    actuators.posture('Stand', 0.5)
+    actuators.join('posture')
+
+def set_volume():
+    actuators.volume(70)
+    actuators.join('volume')
+
+def tablet_sleep():
+    actuators.tablet_sleep()
+    actuators.join('tablet')
 
 def main():
+    started = time.time()
     parser = OptionParser()
     parser.add_option("--pip", help="Parent broker port. The IP address of your robot", dest="pip")
     parser.add_option("--pport", help="Parent broker port. The port NAOqi is listening to", dest="pport", type="int")
     parser.set_defaults(
-        pip=ROBOT_IP,
-        pport=ROBOT_PORT
+        pip=get_section("pepper").get("ip", ROBOT_IP),
+        pport=get_section("pepper").get("port", ROBOT_PORT)
     )
     (opts, args_) = parser.parse_args()
     pip = opts.pip
@@ -180,23 +220,25 @@ def main():
     except:
         pass
 
-    audio = ALProxy("ALAudioDevice")
-    audio.setOutputVolume(70)
-
-    # Toujours DESACTIVER AutonomousLife et mettre debout :
-    AutonomousLife = ALProxy('ALAutonomousLife')
-    if AutonomousLife.getState() != 'disabled':
-        AutonomousLife.setState('disabled')
-    RobotPosture = ALProxy('ALRobotPosture')
-    RobotPosture.goToPosture('Stand', 0.5)
-    print(u'Vie autonome désactivée. Robot debout, prêt à interagir avec gestuelle animée.')
-
-    TabletService = ALProxy('ALTabletService')
-    TabletService.goToSleep()
+    global proxies, actuators
+    proxies = ProxyManager()
+    proxies.start_health_checks()
+    actuators = Actuators(proxies)
 
     global dialogueModule
     dialogueModule = DialogueModule("dialogueModule", pip)
-    dialogueModule.start()
+
+    # Mise en route en parallèle: seule la posture attend la vie autonome,
+    # et la phrase d'accueil est générée pendant que le robot se lève
+    bringup = BringUp(started)
+    bringup.add("volume", set_volume)
+    bringup.add("vie autonome", disable_autonomous_life)
+    bringup.add("posture", stand, after=["vie autonome"])
+    bringup.add("tablette", tablet_sleep)
+    bringup.add("reconnaissance vocale", dialogueModule.configureSpeechRecognition)
+    if START_PROMPT:
+        bringup.add("phrase d'accueil", lambda: safe_decode(chatbot.respond(START_PROMPT)))
+    dialogueModule.start(bringup)
 
     try:
         while True:
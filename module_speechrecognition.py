@@ -12,6 +12,10 @@ from numpy import sqrt, mean, square
 import traceback
 import wave
 
+from pepper_config import get_section
+from pepper_proxies import ProxyManager
+from pepper_speaking import SpeakingState, clear as clear_speaking, request_interrupt
+
 RECORDING_DURATION = 10
 LOOKAHEAD_DURATION = 1.0
 IDLE_RELEASE_TIME = 2.0
@@ -23,11 +27,24 @@ DEFAULT_LANGUAGE = "fr"
 PRINT_RMS = False
 PREBUFFER_WHEN_STOP = False
 AUDIO_FILENAME = "audio_pepper.wav"
+# Fin de parole probable: un extrait est transcrit pour lancer le LLM en avance
+PARTIAL_AUDIO_FILENAME = "audio_pepper.partial.wav"
+SPECULATIVE_IDLE_TIME = 0.6
+
+# Parole du robot signalee par pepper_tts_handler, echo compris (config "tts": "echo_tail")
+speaking = SpeakingState.from_config()
+# Le visiteur coupe la parole au robot: niveau bien au-dessus du seuil (la voix du
+# robot est captee aussi), tenu assez longtemps pour ne pas etre un bruit isole
+BARGE_IN_CONFIG = get_section("barge_in")
+BARGE_IN_FACTOR = BARGE_IN_CONFIG.get("factor", 3.0)
+BARGE_IN_MIN_DURATION = BARGE_IN_CONFIG.get("min_duration", 0.3)
+# Creux toleres entre deux syllabes
+BARGE_IN_MAX_GAP = 0.2
 
 def disable_recording_during_tts():
     """Desactive l'enregistrement quand Pepper parle"""
     # Verifie le flag cree par pepper_tts_handler
-    if os.path.exists("pepper_speaking.flag"):
+    if speaking.active():
         return True
     
     # Backup: verifie aussi le fichier response
@@ -50,6 +67,9 @@ class SpeechRecognitionModule(naoqi.ALModule):
             self.BIND_PYTHON(self.getName(),"callback")
             self.naoIp = naoIp
             self.naoPort = naoPort
+            # Un seul proxy ALAudioDevice, reconnecté après une coupure réseau
+            self.proxies = ProxyManager(naoIp, naoPort)
+            self.audio = self.proxies.get("ALAudioDevice")
             self.memory = naoqi.ALProxy("ALMemory")
             self.memory.declareEvent("SpeechRecognition")
             self.isStarted = False
@@ -71,6 +91,9 @@ class SpeechRecognitionModule(naoqi.ALModule):
             self.holdTime = HOLD_TIME
             self.lookaheadBufferSize = LOOKAHEAD_DURATION * SAMPLE_RATE
             self.fileCounter = 0
+            self.partialPeak = None
+            self.bargeInStart = 0
+            self.bargeInPeak = 0
         except BaseException, err:
             print("ERR: SpeechRecognitionModule: loading error: %s" % str(err))
 
@@ -84,11 +107,10 @@ class SpeechRecognitionModule(naoqi.ALModule):
             return
         print("INF: SpeechRecognitionModule: starting!")
         self.isStarted = True
-        audio = naoqi.ALProxy("ALAudioDevice")
         nNbrChannelFlag = 0
         nDeinterleave = 0
-        audio.setClientPreferences(self.getName(), SAMPLE_RATE, nNbrChannelFlag, nDeinterleave)
-        audio.subscribe(self.getName())
+        self.audio.setClientPreferences(self.getName(), SAMPLE_RATE, nNbrChannelFlag, nDeinterleave)
+        self.audio.subscribe(self.getName())
 
     def pause(self):
         print("INF: SpeechRecognitionModule.pause: stopping")
@@ -96,18 +118,20 @@ class SpeechRecognitionModule(naoqi.ALModule):
             print("INF: SpeechRecognitionModule.stop: not running")
             return
         self.isStarted = False
-        audio = naoqi.ALProxy("ALAudioDevice", self.naoIp, self.naoPort)
-        audio.unsubscribe(self.getName())
+        self.audio.unsubscribe(self.getName())
         print("INF: SpeechRecognitionModule: stopped!")
 
     def stop(self):
         self.pause()
 
     def processRemote(self, nbOfChannels, nbrOfSamplesByChannel, aTimeStamp, buffer):
-        # Ignore si Pepper parle (fonction corrigee)
-        if disable_recording_during_tts():
+        # Ignore si Pepper parle (fonction corrigee), sauf enregistrement lance par une coupure
+        if disable_recording_during_tts() and not self.isRecording:
             # print("DEBUG: Recording disabled - Pepper speaking")
+            if BARGE_IN_CONFIG.get("enabled", True) and self.isAutoDetectionEnabled:
+                self.detectBargeIn(nbOfChannels, nbrOfSamplesByChannel, aTimeStamp, buffer)
             return
+        self.bargeInStart = 0
         
         timestamp = float(str(aTimeStamp[0]) + "." + str(aTimeStamp[1]))
         
@@ -143,6 +167,12 @@ class SpeechRecognitionModule(naoqi.ALModule):
                         timestamp - self.startRecordingTimestamp >= self.holdTime):
                         print('stopping after idle/hold time')
                         self.stopRecordingAndRecognize()
+                    elif self.isRecording and self.lastTimeRMSPeak > 0 and (
+                        self.partialPeak != self.lastTimeRMSPeak) and (
+                        timestamp - self.lastTimeRMSPeak >= SPECULATIVE_IDLE_TIME):
+                        # Un seul extrait par pause; la parole qui reprend en autorise un autre
+                        self.partialPeak = self.lastTimeRMSPeak
+                        self.writePartialAudio()
                 else:
                     self.preBuffer.append(aSoundData)
                     self.preBufferLength += len(aSoundData[0])
@@ -152,6 +182,37 @@ class SpeechRecognitionModule(naoqi.ALModule):
         except:
             traceback.print_exc()
 
+    def detectBargeIn(self, nbOfChannels, nbrOfSamplesByChannel, aTimeStamp, buffer):
+        """Pendant la parole du robot: le visiteur parle-t-il par-dessus?"""
+        timestamp = float(str(aTimeStamp[0]) + "." + str(aTimeStamp[1]))
+        try:
+            aSoundDataInterlaced = np.fromstring(str(buffer), dtype=np.int16)
+            aSoundData = np.reshape(aSoundDataInterlaced, (nbOfChannels, nbrOfSamplesByChannel), 'F')
+            rmsMicFront = self.calcRMSLevel(self.convertStr2SignedInt(aSoundData[0]))
+        except:
+            traceback.print_exc()
+            return
+        if rmsMicFront >= BARGE_IN_FACTOR * self.autoDetectionThreshold:
+            if not self.bargeInStart:
+                self.bargeInStart = timestamp
+            self.bargeInPeak = timestamp
+        elif self.bargeInStart and timestamp - self.bargeInPeak > BARGE_IN_MAX_GAP:
+            self.bargeInStart = 0
+        if not self.bargeInStart:
+            # Hors coupure possible, seul le dernier bloc est garde: la voix du robot n'entre pas dans le prebuffer
+            self.preBuffer = [aSoundData]
+            self.preBufferLength = len(aSoundData[0])
+            return
+        # Debut de la phrase du visiteur, enregistre avec elle si la coupure est confirmee
+        self.preBuffer.append(aSoundData)
+        self.preBufferLength += len(aSoundData[0])
+        if timestamp - self.bargeInStart >= BARGE_IN_MIN_DURATION:
+            # Le lecteur TTS coupe la parole; l'enregistrement commence tout de suite
+            request_interrupt()
+            print("barge-in: %s more than %s" % (rmsMicFront, BARGE_IN_FACTOR * self.autoDetectionThreshold))
+            self.bargeInStart = 0
+            self.startRecording()
+
     def calcRMSLevel(self, data):
         rms = (sqrt(mean(square(data))))
         return rms
@@ -166,6 +227,7 @@ class SpeechRecognitionModule(naoqi.ALModule):
         print("INF: Starting to record audio")
         self.startRecordingTimestamp = 0
         self.lastTimeRMSPeak = 0
+        self.partialPeak = None
         self.buffer = self.preBuffer
         self.isRecording = True
         return
@@ -175,19 +237,40 @@ class SpeechRecognitionModule(naoqi.ALModule):
             print("INF: SpeechRecognitionModule.stopRecordingAndRecognize: not recording")
             return
         print("INF: stopping recording and recognizing")
-        slice = np.concatenate(self.buffer, axis=1)[0]
+        self.writeAudio(AUDIO_FILENAME)
+        print("Audio ecrit :", AUDIO_FILENAME)
+
+        # L'extrait partiel n'a plus d'interet une fois l'enregistrement complet ecrit
+        if os.path.exists(PARTIAL_AUDIO_FILENAME):
+            try:
+                os.remove(PARTIAL_AUDIO_FILENAME)
+            except OSError:
+                pass
 
+        self.isRecording = False
+        return
+
+    def writePartialAudio(self):
+        # Ecrit puis renomme, pour que le STT ne lise jamais un fichier incomplet
+        tmp = PARTIAL_AUDIO_FILENAME + ".tmp"
+        self.writeAudio(tmp)
+        try:
+            if os.path.exists(PARTIAL_AUDIO_FILENAME):
+                os.remove(PARTIAL_AUDIO_FILENAME)
+            os.rename(tmp, PARTIAL_AUDIO_FILENAME)
+            print("Audio partiel ecrit :", PARTIAL_AUDIO_FILENAME)
+        except OSError:
+            pass
+
+    def writeAudio(self, filename):
         # Sauvegarde le buffer audio en WAV
-        wf = wave.open(AUDIO_FILENAME, "wb")
+        slice = np.concatenate(self.buffer, axis=1)[0]
+        wf = wave.open(filename, "wb")
         wf.setnchannels(1)
         wf.setsampwidth(2)
         wf.setframerate(SAMPLE_RATE)
         wf.writeframes(slice.tostring())
         wf.close()
-        print("Audio ecrit :", AUDIO_FILENAME)
-
-        self.isRecording = False
-        return
 
     def calibrate(self):
         self.isCalibrating = True
@@ -236,15 +319,15 @@ def main():
     parser = OptionParser()
     parser.add_option("--pip", help="IP du robot", dest="pip")
     parser.add_option("--pport", help="Port NAOqi", dest="pport", type="int")
-    parser.set_defaults(pip="pepper.local", pport=9559)
+    parser.set_defaults(pip=get_section("pepper").get("ip", "pepper.local"),
+                        pport=get_section("pepper").get("port", 9559))
 
     (opts, args_) = parser.parse_args()
     pip = opts.pip
     pport = opts.pport
 
     # Nettoie les anciens flags au demarrage
-    if os.path.exists("pepper_speaking.flag"):
-        os.remove("pepper_speaking.flag")
+    clear_speaking()
 
     myBroker = naoqi.ALBroker("myBroker", "0.0.0.0", 0, pip, pport)
 
@@ -256,6 +339,7 @@ def main():
 
     global SpeechRecognition
     SpeechRecognition = SpeechRecognitionModule("SpeechRecognition", pip, pport)
+    SpeechRecognition.proxies.start_health_checks()
     SpeechRecognition.start()
     SpeechRecognition.calibrate()
     SpeechRecognition.enableAutoDetection()
@@ -16,6 +16,7 @@ import zmq, os
 import datetime
 from threading import Thread
 from oaichat.openaichat import OaiChat
+from pepper_config import get_section
 
 class OaiServer(OaiChat):
 
@@ -25,8 +26,12 @@ class OaiServer(OaiChat):
         self.socket = self.context.socket(zmq.REP)
         self.socket.bind('tcp://*:'+os.getenv('CHATBOT_SERVER_ADDRESS').split(':')[-1])
         self.thread = None
+        self.metricsServer = None
 
     def start(self):
+        port = get_section('metrics').get('oaichat_port')
+        if port and not self.metricsServer:
+            self.metricsServer = self.metrics.start_server(port)
         self.thread = Thread(target=self._run)
         self.thread.start()
 
@@ -65,6 +70,8 @@ class OaiServer(OaiChat):
         #self.socket.close()
         self.thread = None
         #self.log.close()
+        if self.metricsServer:
+            self.metricsServer.shutdown()
         self.context.destroy()
 
     def listen(self):
@@ -15,6 +15,9 @@ import os, sys, codecs, json
 from datetime import datetime
 from threading import Thread
 from oaichat.oairesponse import OaiResponse
+from llm.backends import UNAVAILABLE_ANSWER, BackendError, BlockingBackend, build_backend
+from llm.history import HistoryWindow
+from llm.metrics import MetricsRecorder, generation_metrics
 
 import dotenv
 dotenv.load_dotenv()
@@ -22,18 +25,22 @@ dotenv.load_dotenv()
 if sys.version_info[0] < 3:
     raise ImportError('OpenAI Chat requires Python 3')
 
-import openai
-from openai import OpenAI
+SUMMARY_PROMPT = u"Résume en quelques phrases courtes cette conversation entre un visiteur et le robot Pepper. Garde les noms, les demandes et les informations utiles pour la suite."
 
 class OaiChat:
   def __init__(self,user,prompt=None):
     self.log = None
+    # OpenAI d'abord, puis les backends de secours de la chaîne "oaichat" de config.json
+    self.llm = BlockingBackend(build_backend('oaichat'))
+    self.metrics = MetricsRecorder.from_config('oaichat')
+    # self.history garde toute la session; seule la fenêtre (section "history") est envoyée
+    self.window = HistoryWindow.from_config(self.summarize)
     self.reset(user,prompt)
-    self.client = OpenAI(api_key = os.getenv('OPENAI_KEY'))
 
   def reset(self,user,prompt=None):
     self.user = user
     self.history = self.loadPrompt(prompt or os.getenv('OPENAI_PROMPTFILE'))
+    self.window.reset()
     self.resetRequestLog()
 
   def resetRequestLog(self):
@@ -52,26 +59,36 @@ class OaiChat:
     #moderator.start()
     self.history.append({'role':'user','content':inputText})
     #print(self.history)
-    response = self.client.chat.completions.create(
-      model="gpt-3.5-turbo-1106",
-      #response_format={ "type": "json_object" },
-      #user=self.user,
-      messages=self.history,
-      # temperature=0.7,
-      max_tokens=150,
-      # top_p=1,
-      # frequency_penalty=1,
-      # presence_penalty=0
-    )
+    messages = self.window.messages(self.history)
+    try:
+      text, generation = self.llm.complete(messages, {'max_tokens': 150})
+      backend = generation.backend
+      m = self.metrics.record(dict(generation_metrics(generation), user=self.user,
+                                   prompt_tokens=self.window.prompt_tokens(messages), history=len(self.history)))
+      print('Generation: prompt %s tokens, ttft %ss, %s tokens, %s tok/s, gap p99 %ss'%(m['prompt_tokens'],m['ttft'],m['tokens'],m['tokens_per_s'],m['gap_p99']))
+    except BackendError as e:
+      print('LLM unavailable:', e)
+      text, backend = UNAVAILABLE_ANSWER, None
+      self.metrics.count('unavailable')
     #moderator.join()
     #print('Moderation:',self.moderation)
-    #print(response.choices[0].message.content)
-    r = OaiResponse(response.model_dump_json())
+    r = OaiResponse({'choices': [{'message': {'role': 'assistant', 'content': text}}], 'backend': backend})
 
     self.history.append({'role':'assistant','content':r.getText()})
-    print('Request delay',datetime.now()-start)
+    print('Request delay',datetime.now()-start,'(%s)'%backend)
     return r
 
+  def summarize(self, summary, messages):
+    """Résume les tours sortis de la fenêtre (appelé en arrière-plan par HistoryWindow)."""
+    lines = [('Visiteur' if m['role'] == 'user' else 'Pepper') + ': ' + m['content'] for m in messages]
+    if summary:
+      lines.insert(0, u'Résumé précédent: ' + summary)
+    text, generation = self.llm.complete([{'role':'system','content':SUMMARY_PROMPT},
+                                          {'role':'user','content':u'\n'.join(lines)}],
+                                         {'max_tokens': self.window.summary_tokens})
+    print('History summarized: %d messages folded (%s)'%(len(messages), generation.backend))
+    return text
+
   def loadPrompt(self,promptFile):
     promptFile = promptFile or 'openai.prompt'
     promptPath = promptFile if os.path.isfile(promptFile) else os.path.join(os.path.dirname(__file__),promptFile)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Ordres aux actionneurs du robot (LEDs, posture, moteurs, volume, vie
+autonome, tablette), Python 2.
+
+Chaque canal garde le dernier état commandé: un ordre identique n'est pas
+renvoyé au robot. Un canal qui sait lire l'état réel (current) le compare
+plutôt à l'ordre, avant de l'envoyer et une fois exécuté. Les ordres partent en asynchrone (post) depuis un fil
+par canal, l'appelant n'attend jamais la fin d'un fondu ou d'un
+mouvement. Si plusieurs changements arrivent pendant qu'un ordre
+s'exécute, seul le dernier est envoyé ensuite.
+"""
+
+import threading
+
+class Channel(object):
+    """Un actionneur: au plus un ordre en cours, et le plus récent en attente."""
+
+    def __init__(self, name, current=None):
+        self.name = name
+        # Lecture de l'état réel sur le robot; sans elle, le dernier état commandé fait foi
+        self.current = current
+        # Dernier état commandé (None: inconnu, le prochain ordre part toujours)
+        self.state = None
+        self._wanted = None
+        self._busy = False
+        self._cond = threading.Condition()
+        worker = threading.Thread(target=self._run)
+        worker.daemon = True
+        worker.start()
+
+    def set(self, state, proxy, method, *args):
+        """Demande l'état; renvoie False s'il est déjà commandé ou en attente."""
+        with self._cond:
+            target = self._wanted[0] if self._wanted else self.state
+            if state == target:
+                return False
+            self._wanted = (state, proxy, method, args)
+            self._cond.notify_all()
+        return True
+
+    def join(self):
+        """Attend que les ordres demandés sur ce canal soient exécutés."""
+        with self._cond:
+            while self._wanted is not None or self._busy:
+                self._cond.wait(1.0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._wanted is None:
+                    self._cond.wait()
+                state, proxy, method, args = self._wanted
+                self._wanted = None
+                self._busy = True
+                # Avec une lecture de l'état réel, rien n'est retenu: l'ordre suivant relira le robot
+                self.state = state if self.current is None else None
+            try:
+                if self.current is None or self.current() != state:
+                    task = getattr(proxy.post, method)(*args)
+                    proxy.wait(task, 0)
+                    if self.current is not None and self.current() != state:
+                        raise RuntimeError("etat {} non atteint".format(state))
+            except Exception as e:
+                print("Ordre {} impossible: {}".format(self.name, e))
+                with self._cond:
+                    if self.state == state:
+                        self.state = None
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+class Actuators(object):
+    """Point de passage des ordres au robot; proxies est un pepper_proxies.ProxyManager."""
+
+    def __init__(self, proxies):
+        self.leds = proxies.get("ALLeds")
+        self.robot_posture = proxies.get("ALRobotPosture")
+        self.motion = proxies.get("ALMotion")
+        self.speech = proxies.get("ALAnimatedSpeech")
+        self.audio = proxies.get("ALAudioDevice")
+        self.life = proxies.get("ALAutonomousLife")
+        self.tablet = proxies.get("ALTabletService")
+        self.channels = {}
+        self._lock = threading.Lock()
+
+    def channel(self, name, current=None):
+        with self._lock:
+            if name not in self.channels:
+                self.channels[name] = Channel(name, current)
+            return self.channels[name]
+
+    def face(self, r, g, b, duration=0.5):
+        return self.channel("face").set((r, g, b), self.leds, "fadeRGB", "FaceLeds", r, g, b, duration)
+
+    def posture(self, name, speed=0.8):
+        # goToPosture rend False en cas d'échec (perdu avec post): la posture réelle fait foi,
+        # y compris quand le robot a été déplacé à la main ou par la vie autonome
+        return self.channel("posture", self.robot_posture.getPosture).set(name, self.robot_posture, "goToPosture",
+                                                                          name, speed)
+
+    def stiffness(self, chain, value):
+        return self.channel("stiffness." + chain).set(value, self.motion, "setStiffnesses", chain, value)
+
+    def body_language(self, mode):
+        return self.channel("body_language").set(mode, self.speech, "setBodyLanguageMode", mode)
+
+    def volume(self, level):
+        return self.channel("volume").set(level, self.audio, "setOutputVolume", level)
+
+    def autonomous_life(self, state):
+        return self.channel("autonomous_life", self.life.getState).set(state, self.life, "setState", state)
+
+    def tablet_sleep(self):
+        return self.channel("tablet").set("sleep", self.tablet, "goToSleep")
+
+    def join(self, *names):
+        """Attend les ordres en cours sur les canaux nommés, ou sur tous."""
+        for channel in [self.channel(name) for name in names] or list(self.channels.values()):
+            channel.join()
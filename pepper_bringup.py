@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Mise en route du robot: étapes indépendantes lancées en parallèle (Python 2).
+
+Chaque étape (volume, vie autonome, posture, première phrase du LLM...)
+tourne dans son propre fil dès qu'elle est ajoutée, une fois finies les
+étapes dont elle dépend (after). wait() rend le résultat d'une étape;
+report() affiche le temps passé dans chacune. Une étape en échec est
+signalée sans bloquer la suite: celles qui en dépendent démarrent quand
+même, l'ordre seul est garanti.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class Step(object):
+
+    def __init__(self, name, after):
+        self.name = name
+        self.after = after
+        self.start = None
+        self.end = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def duration(self):
+        return self.end - self.start if self.end is not None else None
+
+class BringUp(object):
+    """Étapes de démarrage; started est l'instant de référence du rapport (lancement du script)."""
+
+    def __init__(self, started=None):
+        self.started = started or time.time()
+        self.steps = OrderedDict()
+
+    def add(self, name, function, after=()):
+        """Lance function() dans un fil, après les étapes nommées dans after."""
+        step = Step(name, [self.steps[n] for n in after])
+        self.steps[name] = step
+        worker = threading.Thread(target=self._run, args=(step, function))
+        worker.daemon = True
+        worker.start()
+        return step
+
+    def wait(self, *names):
+        """Attend les étapes; renvoie le résultat de la dernière (None si elle a échoué)."""
+        step = None
+        for name in names:
+            step = self.steps[name]
+            # Le délai laisse passer Ctrl-C (Event.wait sans délai ne l'entend pas en Python 2)
+            while not step.done.wait(1.0):
+                pass
+        return step.result if step else None
+
+    def check(self, name):
+        """Comme wait(), pour une étape indispensable: son erreur est relevée ici."""
+        result = self.wait(name)
+        if self.steps[name].error is not None:
+            raise self.steps[name].error
+        return result
+
+    def report(self, label="robot pret"):
+        """Temps de chaque étape, et du lancement jusqu'à maintenant."""
+        elapsed = time.time() - self.started
+        parts = []
+        for step in self.steps.values():
+            if step.end is None:
+                parts.append("{} en cours".format(step.name))
+            else:
+                parts.append("{} {:.2f}s{}".format(step.name, step.duration(), " (echec)" if step.error else ""))
+        total = sum(step.duration() for step in self.steps.values() if step.end is not None)
+        print("Demarrage: {}".format(", ".join(parts)))
+        print("Demarrage: {} en {:.2f}s (etapes cumulees {:.2f}s)".format(label, elapsed, total))
+        return elapsed
+
+    def _run(self, step, function):
+        for previous in step.after:
+            previous.done.wait()
+        step.start = time.time()
+        try:
+            step.result = function()
+        except Exception as e:
+            step.error = e
+            print("Demarrage: etape {} en echec: {}".format(step.name, e))
+        step.end = time.time()
+        step.done.set()
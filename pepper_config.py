@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Lecture de config.json, partagée entre les scripts Python 2 et Python 3."""
+
+import codecs
+import json
+import os
+
+CONFIG_FILE = os.getenv("PEPPER_CONFIG", "config.json")
+# Identifiant du robot servi par ce poste quand un pipeline en sert plusieurs
+DEFAULT_ROBOT = "pepper"
+ROBOT_ID = os.getenv("PEPPER_ROBOT", DEFAULT_ROBOT)
+
+def load_config(path=None):
+    """Charge config.json; renvoie un dict vide si le fichier est absent."""
+    path = path or CONFIG_FILE
+    if not os.path.isfile(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.basename(path))
+    if not os.path.isfile(path):
+        print("WARNING: fichier de configuration introuvable: {}".format(path))
+        return {}
+    with codecs.open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def get_section(name, config=None):
+    """Renvoie une section de la configuration (dict vide si absente)."""
+    if config is None:
+        config = load_config()
+    return config.get(name) or {}
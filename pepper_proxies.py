@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Proxies NAOqi partagés, reconnectés après une coupure réseau (Python 2).
+
+L'adresse du robot est lue dans config.json (section "pepper") et résolue
+une seule fois. Un proxy par service est gardé en cache; un appel qui
+échoue alors que le service ne répond plus au ping marque le proxy comme
+cassé, et la reconnexion est retentée avec un délai croissant, à chaque
+appel et par un fil de surveillance. Chaque appel est chronométré
+(stats() par service.méthode).
+"""
+
+import socket
+import threading
+import time
+
+from naoqi import ALProxy
+
+from pepper_config import get_section
+
+DEFAULT_IP = "pepper.local"
+DEFAULT_PORT = 9559
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 10.0
+HEALTH_INTERVAL = 2.0
+
+class ProxyUnavailable(RuntimeError):
+    """Le service n'est pas joignable pour le moment (reconnexion en attente)."""
+
+class CallStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed, error=False):
+        self.calls += 1
+        self.errors += int(error)
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def summary(self):
+        return {"calls": self.calls, "errors": self.errors,
+                "mean": round(self.total / self.calls, 4) if self.calls else None, "max": round(self.max, 4)}
+
+class ManagedProxy(object):
+    """S'utilise comme un ALProxy: proxy.say(...), proxy.post.say(...)."""
+
+    def __init__(self, manager, service, post=False):
+        self._manager = manager
+        self._service = service
+        self._post = post
+        if not post:
+            self.post = ManagedProxy(manager, service, post=True)
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def call(*args):
+            return self._manager.call(self._service, method, args, self._post)
+        return call
+
+class ProxyManager(object):
+    """Cache des proxies par service; sans ip, les proxies passent par le broker local."""
+
+    def __init__(self, ip=None, port=DEFAULT_PORT):
+        self.host = ip
+        self.port = port
+        if ip:
+            try:
+                # Résolution unique: pepper.local (mDNS) peut prendre plusieurs secondes
+                self.host = socket.gethostbyname(ip)
+            except socket.error:
+                print("WARNING: adresse {} non resolue, resolution laissee a NAOqi".format(ip))
+        self.proxies = {}
+        self.broken = {}
+        self.reconnects = 0
+        self.stats_by_call = {}
+        self._lock = threading.Lock()
+        self._health = None
+
+    @classmethod
+    def from_config(cls, ip=None, port=None, config=None):
+        """Adresse de la section "pepper", sauf si ip/port sont donnés (ligne de commande)."""
+        section = get_section("pepper", config)
+        return cls(ip or section.get("ip", DEFAULT_IP), port or section.get("port", DEFAULT_PORT))
+
+    def get(self, service):
+        """Proxy géré du service; la connexion est établie au premier appel."""
+        return ManagedProxy(self, service)
+
+    def proxy(self, service):
+        """ALProxy connecté du service, reconnecté si besoin; ProxyUnavailable pendant l'attente."""
+        with self._lock:
+            proxy = self.proxies.get(service)
+            if proxy is not None:
+                return proxy
+            retry_at, backoff = self.broken.get(service, (0, MIN_BACKOFF))
+            if time.time() < retry_at:
+                raise ProxyUnavailable("{}: reconnexion dans {:.1f}s".format(service, retry_at - time.time()))
+            try:
+                proxy = ALProxy(service, self.host, self.port) if self.host else ALProxy(service)
+            except Exception as e:
+                self.broken[service] = (time.time() + backoff, min(backoff * 2, MAX_BACKOFF))
+                raise ProxyUnavailable("{}: {}".format(service, e))
+            if service in self.broken:
+                del self.broken[service]
+                self.reconnects += 1
+                print("NAOqi: {} reconnecte".format(service))
+            self.proxies[service] = proxy
+            return proxy
+
+    def call(self, service, method, args, post=False):
+        key = "{}.{}".format(service, method)
+        proxy = self.proxy(service)
+        start = time.time()
+        try:
+            result = getattr(proxy.post if post else proxy, method)(*args)
+        except RuntimeError:
+            self._record(key, time.time() - start, True)
+            if self.check(service):
+                # Erreur du service lui-même: la connexion est saine
+                raise
+            # Coupure: l'appel n'est pas arrivé, on le rejoue une fois sur la nouvelle connexion
+            proxy = self.proxy(service)
+            start = time.time()
+            result = getattr(proxy.post if post else proxy, method)(*args)
+        self._record(key, time.time() - start)
+        return result
+
+    def check(self, service):
+        """Ping du service; en cas d'échec le proxy est oublié et sera recréé."""
+        with self._lock:
+            proxy = self.proxies.get(service)
+        if proxy is None:
+            return False
+        try:
+            proxy.ping()
+            return True
+        except Exception:
+            with self._lock:
+                if self.proxies.get(service) is proxy:
+                    del self.proxies[service]
+                    self.broken.setdefault(service, (0, MIN_BACKOFF))
+                    print("NAOqi: {} ne repond plus".format(service))
+            return False
+
+    def start_health_checks(self, interval=HEALTH_INTERVAL):
+        """Fil de surveillance: ping des services connectés, reconnexion des services perdus."""
+        if self._health is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                for service in list(self.proxies):
+                    self.check(service)
+                for service in list(self.broken):
+                    try:
+                        self.proxy(service)
+                    except ProxyUnavailable:
+                        pass
+
+        self._health = threading.Thread(target=run)
+        self._health.daemon = True
+        self._health.start()
+
+    def stats(self):
+        with self._lock:
+            calls = dict((key, s.summary()) for key, s in self.stats_by_call.items())
+            return {"host": self.host, "connected": sorted(self.proxies), "broken": sorted(self.broken),
+                    "reconnects": self.reconnects, "calls": calls}
+
+    def _record(self, key, elapsed, error=False):
+        with self._lock:
+            if key not in self.stats_by_call:
+                self.stats_by_call[key] = CallStats()
+            self.stats_by_call[key].add(elapsed, error)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""État de parole du robot, partagé entre le lecteur TTS et la capture audio (Python 2).
+
+pepper_tts_handler.py écrit dans pepper_speaking.flag, à chaque phrase
+lancée, l'heure de fin estimée d'après la longueur du texte
+({"until": ...}), puis l'heure de fin réelle dès que la tâche de parole
+se termine ({"ended": ...}). La capture reprend l'écoute après un court
+délai d'écho; si la fin n'est jamais signalée, l'estimation sert de borne.
+
+Dans l'autre sens, la capture qui entend le visiteur parler par-dessus le
+robot écrit l'heure de détection dans pepper_interrupt.flag; le lecteur
+TTS coupe alors la parole et jette la suite de la réponse. Sans connexion
+au pipeline, le lecteur le prévient de la même façon par interrupt.json
+dans son dossier de réponses.
+"""
+
+import json
+import os
+import time
+
+from pepper_config import get_section
+
+TTS_ACTIVE_FLAG = "pepper_speaking.flag"
+INTERRUPT_FLAG = "pepper_interrupt.flag"
+# Coupure transmise au pipeline en mode dossier (dans tts_responses/)
+RESPONSE_INTERRUPT_FILE = "interrupt.json"
+# Débit moyen de la voix française de Pepper
+DEFAULT_CHARS_PER_SECOND = 14.0
+# L'écho de la voix dans la salle, après la fin de la parole
+DEFAULT_ECHO_TAIL = 0.25
+# Au-delà de la fin estimée (plus cette marge), la parole est considérée finie
+ESTIMATE_MARGIN = 2.0
+CHECK_INTERVAL = 0.05
+
+def estimate_duration(text, chars_per_second=DEFAULT_CHARS_PER_SECOND):
+    return len(text) / float(chars_per_second)
+
+def _write(state, path=TTS_ACTIVE_FLAG):
+    with open(path, "w") as f:
+        f.write(json.dumps(state))
+
+def mark_speaking(until, path=TTS_ACTIVE_FLAG):
+    _write({"until": until}, path)
+
+def mark_silent(ended=None, path=TTS_ACTIVE_FLAG):
+    _write({"ended": ended or time.time()}, path)
+
+def clear(path=TTS_ACTIVE_FLAG, interrupt_path=INTERRUPT_FLAG):
+    for flag in (path, interrupt_path):
+        if os.path.exists(flag):
+            os.remove(flag)
+
+def request_interrupt(detected=None, path=INTERRUPT_FLAG):
+    """Côté capture: le visiteur parle pendant que le robot parle."""
+    _write({"detected": detected or time.time()}, path)
+
+def take_interrupt(path=INTERRUPT_FLAG):
+    """Côté lecteur: heure de la détection en attente, ou None; la demande est consommée."""
+    try:
+        with open(path, "r") as f:
+            content = f.read().strip()
+        os.remove(path)
+    except (IOError, OSError):
+        return None
+    try:
+        return float(json.loads(content)["detected"])
+    except (ValueError, KeyError, TypeError):
+        # Demande mal écrite: la coupure reste voulue
+        return time.time()
+
+class SpeakingState(object):
+    """Côté capture: le robot parle-t-il (écho compris)? Le drapeau est relu au plus toutes les 50 ms."""
+
+    def __init__(self, echo_tail=DEFAULT_ECHO_TAIL, path=TTS_ACTIVE_FLAG):
+        self.echo_tail = echo_tail
+        self.path = path
+        self.state = {}
+        self._checked = 0
+
+    @classmethod
+    def from_config(cls, config=None):
+        return cls(get_section("tts", config).get("echo_tail", DEFAULT_ECHO_TAIL))
+
+    def active(self):
+        now = time.time()
+        if now - self._checked >= CHECK_INTERVAL:
+            self._checked = now
+            self.state = self._read()
+        if "ended" in self.state:
+            return now < self.state["ended"] + self.echo_tail
+        if "until" in self.state:
+            return now < self.state["until"] + ESTIMATE_MARGIN
+        return bool(self.state)
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                content = f.read().strip()
+        except IOError:
+            return {}
+        if not content:
+            # Drapeau en cours d'écriture: l'état précédent reste valable
+            return self.state
+        try:
+            state = json.loads(content)
+        except ValueError:
+            state = None
+        # Ancien format ("speaking") ou écriture incomplète: le robot parle
+        return state if isinstance(state, dict) else {"speaking": True}
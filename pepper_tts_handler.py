@@ -4,87 +4,523 @@
 import os
 import time
 import codecs
-import re
-from naoqi import ALProxy
-
-PEPPER_IP = "192.168.1.58"
-PEPPER_PORT = 9559
-TTS_RESPONSE_DIR = "tts_responses"
-TTS_ACTIVE_FLAG = "pepper_speaking.flag"
-
-anim_tts = ALProxy("ALAnimatedSpeech", PEPPER_IP, PEPPER_PORT)
-posture  = ALProxy("ALRobotPosture",    PEPPER_IP, PEPPER_PORT)
-leds      = ALProxy("ALLeds",            PEPPER_IP, PEPPER_PORT)
-motion    = ALProxy("ALMotion",          PEPPER_IP, PEPPER_PORT)
-
-def clean_text_for_tts(text):
-    if isinstance(text, unicode):
-        text = text.encode('latin-1', 'ignore')
-    elif isinstance(text, str):
-        try:
-            text = text.decode('utf-8', 'ignore').encode('latin-1', 'ignore')
-        except:
-            pass
-    return re.sub(r'[\x00-\x1f\x7f]', '', text.decode('latin-1')).strip()
+import json
+import socket
+import threading
+import Queue
+from collections import OrderedDict
+
+from pepper_actuators import Actuators
+from pepper_bringup import BringUp
+from pepper_proxies import ProxyManager
+from pepper_speaking import (DEFAULT_CHARS_PER_SECOND, RESPONSE_INTERRUPT_FILE, clear as clear_speaking,
+                             estimate_duration, mark_silent, mark_speaking, request_interrupt, take_interrupt)
+from llm.phrases import FILLERS, REPROMPT_AGAIN, REPROMPTS
+from llm.textmatch import normalize_text
+from llm.tts_text import as_text, normalize_for_tts, speech_bytes
+from pepper_config import DEFAULT_ROBOT, ROBOT_ID, get_section
+
+# Un pipeline peut servir plusieurs robots: chacun lit son dossier (PEPPER_ROBOT)
+TTS_RESPONSE_DIR = "tts_responses" if ROBOT_ID == DEFAULT_ROBOT else os.path.join("tts_responses", ROBOT_ID)
+# Morceaux poussés par le pipeline (voir llm/events.py); le dossier reste le mode de secours
+PIPELINE_CONFIG = get_section("pipeline")
+TTS_QUEUE_ADDRESS = (PIPELINE_CONFIG.get("events_host", "127.0.0.1"), PIPELINE_CONFIG.get("tts_port", 5571))
+RECONNECT_INTERVAL = 2.0
+# Attente d'un morceau suivant avant de quitter le mode parole (LEDs); l'écoute, elle,
+# reprend dès la fin de chaque phrase (voir pepper_speaking)
+SPEAKING_LINGER = 0.3
+CHARS_PER_SECOND = get_section("tts").get("chars_per_second", DEFAULT_CHARS_PER_SECOND)
+# Phrases fréquentes: audio synthétisé une fois sur le robot, puis rejoué
+PHRASE_CACHE_CONFIG = get_section("phrase_cache")
+# Pendant la parole, vérifie à ce rythme si un morceau est arrivé ou si la phrase est finie
+PLAYBACK_POLL = 0.05
+# Coupure demandée par la capture (le visiteur parle par-dessus le robot), voir pepper_speaking
+INTERRUPT_POLL = 0.02
+
+# Adresse du robot lue dans config.json; les proxies se reconnectent après une coupure
+proxies  = ProxyManager.from_config()
+anim_tts = proxies.get("ALAnimatedSpeech")
+tts      = proxies.get("ALTextToSpeech")
+player   = proxies.get("ALAudioPlayer")
+# LEDs, posture et moteurs: seuls les changements partent, sans bloquer la parole
+actuators = Actuators(proxies)
 
-def init_pepper_tts():
+def stand():
     # Met Pepper debout et active la rigidité
-    posture.goToPosture("Stand", 0.8)
-    motion.setStiffnesses("Body", 1.0)
+    actuators.posture("Stand", 0.8)
+    actuators.join("posture")
+    actuators.stiffness("Body", 1.0)
+    actuators.join("stiffness.Body")
+
+def enable_body_language():
     # Active les mouvements contextuels
-    anim_tts.setBodyLanguageMode(1)  # 1 = contextual gestures
-    time.sleep(1)
-    leds.fadeRGB("FaceLeds", 0.0, 0.0, 0.0, 1.0)
+    actuators.body_language(1)  # 1 = contextual gestures
+    actuators.join("body_language")
+
+def lights_off():
+    actuators.face(0.0, 0.0, 0.0, 1.0)
+    actuators.join("face")
+
+def init_pepper_tts(started=None):
+    """Mise en route en parallèle; renvoie le cache de phrases, prêt à être rempli."""
+    bringup = BringUp(started)
+    bringup.add("posture", stand)
+    bringup.add("gestuelle", enable_body_language)
+    bringup.add("LEDs", lights_off)
+    # Voix et langue lues pendant que le robot se lève; la synthèse des phrases suit en arrière-plan
+    bringup.add("cache de phrases", create_phrase_cache)
+    phrases = bringup.wait("cache de phrases")
+    bringup.wait("posture", "gestuelle", "LEDs")
+    bringup.report("lecteur TTS pret")
+    return phrases
+
+def start_speaking():
+    # Mode parole : yeux violets
+    actuators.face(1.0, 0.0, 1.0, 0.5)
+
+def stop_speaking():
+    # Fin parole : LEDs off (le STT est libéré par Playback à la fin de la phrase)
+    actuators.face(0.0, 0.0, 0.0, 1.0)
+
+class PhraseCache(object):
+    """Audio des phrases fréquentes (relances, phrases d'attente, réponses en cache), sur le robot.
+
+    Une phrase absente est synthétisée en arrière-plan avec
+    ALTextToSpeech.sayToFile, puis rejouée par ALAudioPlayer les fois
+    suivantes: elle démarre sans délai de synthèse. La clé est le texte
+    normalisé, la voix et la langue. Les fichiers occupent au plus
+    max_entries emplacements: celui de la phrase la moins récemment dite
+    est réécrit pour une nouvelle, jamais pendant qu'il est joué (get()
+    le réserve jusqu'à done()).
+    """
+
+    def __init__(self, directory="/tmp", max_entries=64):
+        self.directory = directory
+        self.max_entries = max_entries
+        # Lues une fois: changer de voix demande de relancer le lecteur
+        self.voice = tts.getVoice()
+        self.language = tts.getLanguage()
+        self.entries = OrderedDict()
+        self._slots = 0
+        # Fichiers en cours de lecture, que la synthèse ne doit pas réécrire
+        self._in_use = set()
+        self._lock = threading.Lock()
+        self._pending = Queue.Queue()
+        worker = threading.Thread(target=self._synthesize_pending)
+        worker.daemon = True
+        worker.start()
+
+    def key(self, sentence):
+        return (normalize_text(sentence), self.voice, self.language)
+
+    def get(self, sentence):
+        """Chemin du fichier de la phrase sur le robot, ou None; réservé jusqu'à done(path)."""
+        key = self.key(sentence)
+        with self._lock:
+            path = self.entries.pop(key, None)
+            if path is not None:
+                self.entries[key] = path
+                self._in_use.add(path)
+            return path
+
+    def done(self, path):
+        """Fin de lecture: l'emplacement peut de nouveau être réécrit."""
+        with self._lock:
+            self._in_use.discard(path)
+
+    def remember(self, sentence):
+        """Demande la synthèse de la phrase pour les fois suivantes."""
+        self._pending.put(sentence)
+
+    def warm(self, sentences):
+        for sentence in sentences:
+            self.remember(sentence)
+
+    def _store(self, sentence):
+        key = self.key(sentence)
+        with self._lock:
+            if key in self.entries or not key[0]:
+                return
+            if self._slots < self.max_entries:
+                path = "{}/pepperchat_phrase_{:03d}.wav".format(self.directory, self._slots)
+                self._slots += 1
+            else:
+                # Emplacement de la phrase la moins récemment dite, hors lecture en cours
+                oldest = next((k for k, p in self.entries.items() if p not in self._in_use), None)
+                if oldest is None:
+                    return
+                path = self.entries.pop(oldest)
+        tts.sayToFile(speech_bytes(sentence), path)
+        with self._lock:
+            self.entries[key] = path
+
+    def _synthesize_pending(self):
+        while True:
+            sentence = self._pending.get()
+            try:
+                self._store(sentence)
+            except Exception as e:
+                print("Synthese en cache impossible:", e)
+
+def create_phrase_cache():
+    if not PHRASE_CACHE_CONFIG.get("enabled", True):
+        return None
+    cache = PhraseCache(PHRASE_CACHE_CONFIG.get("dir", "/tmp"), PHRASE_CACHE_CONFIG.get("max_entries", 64))
+    cache.warm([normalize_for_tts(p) for p in REPROMPTS + [REPROMPT_AGAIN] + FILLERS + PHRASE_CACHE_CONFIG.get("warmup", [])])
+    return cache
+
+class Playback(object):
+    """Enchaîne les phrases sans blanc: say() non bloquant (post.say) et attente de la tâche en cours.
+
+    La phrase suivante est lue et nettoyée pendant que la précédente est
+    dite, puis lancée dès la fin de celle-ci: il ne reste entre deux
+    phrases que la pause naturelle de la synthèse. L'écart mesuré va de la
+    fin d'une phrase au lancement de la suivante, dans une même prise de
+    parole; report(message) reçoit chaque phrase dite avec son écart.
+    Les phrases du cache sont rejouées par ALAudioPlayer, sans synthèse.
+
+    interrupt() coupe la parole depuis un autre fil: les phrases du tour
+    interrompu (cancelled) ne sont plus dites, et on_interrupt(turn)
+    prévient la source des phrases.
+    """
+
+    def __init__(self, report=None, phrases=None, on_interrupt=None):
+        self.report = report
+        self.phrases = phrases
+        self.on_interrupt = on_interrupt
+        self.proxy = anim_tts
+        self.task = None
+        self.current = None
+        self.turn = None
+        self.ended = None
+        self.gaps = []
+        # Tours annulés par le pipeline ou interrompus par le visiteur
+        self.cancelled = set()
+        self.interrupts = 0
+        # current est partagé avec le fil des coupures; _stopping: phrase qu'interrupt() est en train d'arrêter
+        self._cond = threading.Condition()
+        self._stopping = None
+
+    def play(self, message):
+        # Texte déjà mis en forme par le pipeline (llm.tts_text), reçu en UTF-8
+        sentence = as_text(message.get("text", u""))
+        if not sentence:
+            return
+        interrupts = self.interrupts
+        if self.current and self.current.get("filler") and not message.get("filler"):
+            # La réponse est prête: la phrase d'attente s'arrête au lieu de la retarder
+            self.stop()
+        self.wait()
+        if self.interrupts != interrupts or message.get("turn") in self.cancelled:
+            # Coupure pendant la phrase précédente: celle-ci fait partie de la réponse abandonnée
+            return
+        self.turn = message.get("turn")
+        path = self.phrases.get(sentence) if self.phrases else None
+        gap = time.time() - self.ended if self.ended is not None else None
+        print("Pepper dit:", sentence)
+        # Connue avant le lancement: une coupure pendant le say() porte sur cette phrase
+        with self._cond:
+            self.current = current = dict(message, started=time.time(), gap=gap, cached=bool(path), path=path)
+        try:
+            if path:
+                self.proxy = player
+                self.task = player.post.playFile(path)
+            else:
+                # ALAnimatedSpeech gère les gestes automatiquement
+                self.proxy = anim_tts
+                self.task = anim_tts.post.say(speech_bytes(sentence))
+        except RuntimeError as e:
+            # Robot injoignable: la phrase est perdue, le lecteur continue
+            print("Parole impossible:", e)
+            with self._cond:
+                self.current = None
+            if path:
+                self.phrases.done(path)
+            return
+        current["started"] = time.time()
+        # Bloque STT jusqu'à la fin de la phrase; l'estimation sert de borne si la fin n'arrive pas
+        mark_speaking(time.time() + estimate_duration(sentence, CHARS_PER_SECOND))
+        if not path and self.phrases and message.get("cache"):
+            self.phrases.remember(sentence)
+        if gap is not None:
+            self.gaps.append(gap)
+
+    def interrupt(self, detected):
+        """Le visiteur parle: arrêt immédiat de la parole et abandon du reste du tour."""
+        with self._cond:
+            current = self._stopping = self.current
+            turn = current.get("turn") if current else self.turn
+            self.interrupts += 1
+            if turn is not None:
+                self.cancelled.add(turn)
+        try:
+            tts.stopAll()
+            if self.proxy is player:
+                player.stopAll()
+        except RuntimeError as e:
+            print("Arret de la parole impossible:", e)
+        # Du signal de la capture au silence (stopAll rend la main une fois la voix coupée)
+        latency = round(time.time() - detected, 3)
+        with self._cond:
+            if current is not None:
+                # wait() attend ce délai avant de rendre compte de la phrase
+                current["interrupt_latency"] = latency
+            self._stopping = None
+            self._cond.notify_all()
+        if current is not None:
+            print("Parole coupee par le visiteur, silence en {:.3f}s".format(latency))
+        if self.on_interrupt:
+            self.on_interrupt(turn)
+
+    def stop(self):
+        """Arrête la phrase en cours (sa fin est ensuite constatée par wait())."""
+        try:
+            self.proxy.stop(self.task)
+        except RuntimeError as e:
+            print("Arret de la phrase impossible:", e)
+
+    def running(self):
+        try:
+            return self.task is not None and self.proxy.isRunning(self.task)
+        except RuntimeError:
+            return False
+
+    def idle_for(self):
+        """Temps écoulé depuis la fin de la dernière phrase (0 si une phrase est en cours)."""
+        if self.running():
+            return 0.0
+        self.wait()
+        return time.time() - self.ended if self.ended is not None else 0.0
+
+    def wait(self):
+        """Attend la fin de la phrase en cours."""
+        if self.task is None:
+            return
+        try:
+            self.proxy.wait(self.task, 0)
+        except RuntimeError:
+            pass
+        self.task = None
+        self.ended = time.time()
+        # Fin de parole confirmée: la capture reprend après le délai d'écho
+        mark_silent(self.ended)
+        with self._cond:
+            while self._stopping is not None and self._stopping is self.current:
+                self._cond.wait(1.0)
+            played, self.current = self.current, None
+        if played["path"]:
+            self.phrases.done(played["path"])
+        played["duration"] = round(self.ended - played["started"], 3)
+        if played["gap"] is not None:
+            played["gap"] = round(played["gap"], 3)
+        if self.report:
+            self.report(played)
+
+    def finish(self):
+        """Fin de la prise de parole: attend la dernière phrase et affiche les écarts."""
+        self.wait()
+        if self.gaps:
+            print("Ecarts entre phrases: {}".format(", ".join("{:.2f}s".format(g) for g in self.gaps)))
+        self.ended = None
+        self.gaps = []
+
+def run_posture(command):
+    """Ordre direct du pipeline: la posture démarre sans attendre la parole."""
+    if command.get("posture"):
+        print("Commande:", command.get("command"))
+        actuators.posture(str(command["posture"]), 0.8)
+
+def run_command(path):
+    """Ordre direct lu dans un fichier .cmd."""
+    try:
+        with codecs.open(path, "r", encoding="utf-8") as f:
+            command = json.load(f)
+        os.remove(path)
+    except:
+        return
+    run_posture(command)
 
 def get_all_response_files():
     if not os.path.isdir(TTS_RESPONSE_DIR):
         return []
-    files = [f for f in os.listdir(TTS_RESPONSE_DIR) if f.endswith(".txt")]
+    files = [f for f in os.listdir(TTS_RESPONSE_DIR) if f.endswith(".txt") or f.endswith(".cmd")]
     files.sort()
     return [os.path.join(TTS_RESPONSE_DIR, f) for f in files]
 
-def monitor_tts_responses_led():
+def connect_tts_queue():
+    """Se connecte au pipeline pour recevoir les morceaux; None si le pipeline n'écoute pas."""
+    try:
+        conn = socket.create_connection(TTS_QUEUE_ADDRESS, timeout=1.0)
+    except (socket.error, socket.timeout):
+        return None
+    conn.settimeout(None)
+    conn.sendall(json.dumps({"hello": ROBOT_ID}) + "\n")
+    return conn
+
+# Le fil de lecture des phrases et celui des coupures écrivent sur la même connexion
+send_lock = threading.Lock()
+
+def send_to_pipeline(conn, record):
+    try:
+        with send_lock:
+            conn.sendall(json.dumps(record) + "\n")
+    except socket.error:
+        pass
+
+def report_played(conn):
+    """Renvoie au pipeline chaque phrase dite (durée, écart avec la précédente, délai de coupure)."""
+    def report(played):
+        send_to_pipeline(conn, {"type": "played", "turn": played.get("turn"), "seq": played.get("seq"),
+                                "duration": played["duration"], "gap": played["gap"], "cached": played["cached"],
+                                "interrupt_latency": played.get("interrupt_latency")})
+    return report
+
+def notify_interrupt(conn):
+    """Le pipeline arrête la génération du tour interrompu."""
+    def on_interrupt(turn):
+        send_to_pipeline(conn, {"type": "interrupt", "turn": turn})
+    return on_interrupt
+
+def drop_response_files(turn):
+    """Mode dossier: les phrases pas encore lues sont retirées et le pipeline est prévenu.
+
+    Les fichiers ne portent pas de tour: la marque de coupure arrête celui
+    en cours côté pipeline. Les ordres (.cmd) restent exécutés.
+    """
+    for path in get_all_response_files():
+        if path.endswith(".txt"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    request_interrupt(path=os.path.join(TTS_RESPONSE_DIR, RESPONSE_INTERRUPT_FILE))
+
+def watch_interrupts(playback):
+    """Fil de surveillance des coupures demandées par la capture."""
+    while True:
+        detected = take_interrupt()
+        if detected is not None:
+            playback.interrupt(detected)
+        time.sleep(INTERRUPT_POLL)
+
+def read_tts_queue(conn, messages, cancelled):
+    """Fil de lecture: chaque ligne reçue entre dans la file; None à la déconnexion."""
+    stream = conn.makefile("rb")
+    try:
+        for line in iter(stream.readline, ""):
+            try:
+                message = json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue
+            if message.get("type") == "cancel":
+                # Tour annulé: ses morceaux encore en file ne seront pas dits
+                cancelled.add(message.get("turn"))
+            else:
+                messages.put(message)
+    except socket.error:
+        pass
+    messages.put(None)
+
+def next_message(messages, playback):
+    """Morceau suivant, pris dès qu'il arrive, pendant que la phrase en cours est dite.
+
+    Renvoie False si rien n'arrive dans SPEAKING_LINGER après la fin de la parole.
+    """
+    while True:
+        try:
+            return messages.get(timeout=PLAYBACK_POLL)
+        except Queue.Empty:
+            if playback.idle_for() > SPEAKING_LINGER:
+                return False
+
+def monitor_tts_queue(conn, playback):
+    """Dit les morceaux dans l'ordre d'arrivée, chacun dès que le précédent est fini."""
+    print("Connecte au pipeline {}:{}".format(*TTS_QUEUE_ADDRESS))
+    messages = Queue.Queue()
+    # Les numéros de tour repartent de 1 si le pipeline a redémarré
+    playback.cancelled = set()
+    playback.report = report_played(conn)
+    playback.on_interrupt = notify_interrupt(conn)
+    reader = threading.Thread(target=read_tts_queue, args=(conn, messages, playback.cancelled))
+    reader.daemon = True
+    reader.start()
+
+    # Mode écoute : yeux verts
+    actuators.face(0.0, 1.0, 0.0, 0.5)
+    message = {}
+    while message is not None:
+        try:
+            # Le délai laisse passer Ctrl-C (Queue.get sans délai ne l'entend pas en Python 2)
+            message = messages.get(timeout=1.0)
+        except Queue.Empty:
+            continue
+        if message is None:
+            break
+
+        start_speaking()
+        while message:
+            if message.get("turn") not in playback.cancelled:
+                if message.get("type") == "command":
+                    run_posture(message)
+                else:
+                    playback.play(message)
+            message = next_message(messages, playback)
+        playback.finish()
+        stop_speaking()
+        actuators.face(0.0, 1.0, 0.0, 0.5)
+        # Latences des appels NAOqi et reconnexions, exposées par les métriques du pipeline
+        send_to_pipeline(conn, {"type": "naoqi", "stats": proxies.stats()})
+
+    playback.report = None
+    playback.on_interrupt = drop_response_files
+    conn.close()
+    print("Pipeline deconnecte, retour a la surveillance de {}".format(TTS_RESPONSE_DIR))
+
+def monitor_tts_responses_led(started=None):
     """TTS avec ALAnimatedSpeech, LEDs et mouvements contextuels."""
-    init_pepper_tts()
+    playback = Playback(phrases=init_pepper_tts(started), on_interrupt=drop_response_files)
+    # Le visiteur peut couper la parole, en mode connecté comme en mode dossier
+    watcher = threading.Thread(target=watch_interrupts, args=(playback,))
+    watcher.daemon = True
+    watcher.start()
 
+    last_connect = 0
     while True:
-        # Mode écoute : yeux verts
-        leds.fadeRGB("FaceLeds", 0.0, 1.0, 0.0, 0.5)
+        # Le pipeline pousse les morceaux dès qu'un lecteur est connecté
+        if time.time() - last_connect > RECONNECT_INTERVAL:
+            last_connect = time.time()
+            conn = connect_tts_queue()
+            if conn:
+                monitor_tts_queue(conn, playback)
+
+        # Mode compatibilité : dossier tts_responses/, yeux verts
+        actuators.face(0.0, 1.0, 0.0, 0.5)
 
         files = get_all_response_files()
         if files:
-            # Mode parole : yeux violets
-            leds.fadeRGB("FaceLeds", 1.0, 0.0, 1.0, 0.5)
-            # Bloque STT
-            with open(TTS_ACTIVE_FLAG, "w") as f:
-                f.write("speaking")
+            start_speaking()
 
             for path in files:
+                if path.endswith(".cmd"):
+                    run_command(path)
+                    continue
                 try:
                     with codecs.open(path, "r", encoding="utf-8") as f:
                         sentence = f.read().strip()
                     os.remove(path)
                 except:
                     continue
+                playback.play({"text": sentence, "filler": path.endswith(".filler.txt")})
 
-                clean_sentence = clean_text_for_tts(sentence)
-                if clean_sentence:
-                    print("Pepper dit:", clean_sentence)
-                    # ALAnimatedSpeech gère les gestes automatiquement
-                    anim_tts.say(clean_sentence.encode('utf-8'))
-                    time.sleep(0.2)
-
-            # Fin parole : LEDs off + libère STT
-            leds.fadeRGB("FaceLeds", 0.0, 0.0, 0.0, 1.0)
-            if os.path.exists(TTS_ACTIVE_FLAG):
-                os.remove(TTS_ACTIVE_FLAG)
+            playback.finish()
+            stop_speaking()
 
         time.sleep(0.1)
 
 if __name__ == "__main__":
+    started = time.time()
     # Nettoyage initial
-    if os.path.exists(TTS_ACTIVE_FLAG):
-        os.remove(TTS_ACTIVE_FLAG)
+    clear_speaking()
     if os.path.isdir(TTS_RESPONSE_DIR):
         for f in os.listdir(TTS_RESPONSE_DIR):
             try:
@@ -92,5 +528,6 @@ if __name__ == "__main__":
             except:
                 pass
 
+    proxies.start_health_checks()
     print("TTS Pepper avec ALAnimatedSpeech contextuel prêt.")
-    monitor_tts_responses_led()
+    monitor_tts_responses_led(started)
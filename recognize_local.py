@@ -1,13 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import math
 import os
 import time
 import torch
 import whisper
 
+from llm.events import send_stt_event
+from pepper_config import ROBOT_ID
+
 # Fichiers et paramètres
 AUDIO_FILENAME = "audio_pepper.wav"
+PARTIAL_AUDIO_FILENAME = "audio_pepper.partial.wav"
 STT_RESULT_FILE = "stt_result.txt"
 LANGUAGE = "fr"
 
@@ -17,12 +22,31 @@ print(f"Chargement du modèle Whisper large sur {device}...")
 model = whisper.load_model("large").to(device)
 print("Modèle chargé.")
 
+def transcript_confidence(result):
+    """Confiance entre 0 et 1: probabilité moyenne des tokens (avg_logprob) pondérée
+    par la probabilité qu'il y ait bien de la parole (1 - no_speech_prob), par segment."""
+    segments = result.get("segments") or []
+    total = sum(max(s["end"] - s["start"], 0.01) for s in segments)
+    if not total:
+        return 0.0
+    return sum(math.exp(s["avg_logprob"]) * (1.0 - s["no_speech_prob"]) * max(s["end"] - s["start"], 0.01)
+               for s in segments) / total
+
 def transcribe(path):
-    """Transcrit un fichier audio en texte français avec Whisper."""
+    """Transcrit un fichier audio en texte français avec Whisper; renvoie (texte, confiance)."""
     result = model.transcribe(path, language=LANGUAGE)
     text = result.get("text", "").strip()
-    print("---RESULT---:", text)
-    return text
+    confidence = transcript_confidence(result)
+    print("---RESULT---: {} (confiance {:.2f})".format(text, confidence))
+    return text, confidence
+
+def handle_final():
+    text, confidence = transcribe(AUDIO_FILENAME)
+    # Envoi direct au pipeline, fichier en secours s'il n'écoute pas
+    if text and not send_stt_event(text, robot=ROBOT_ID, confidence=round(confidence, 3)):
+        with open(STT_RESULT_FILE, "w", encoding="utf-8") as f:
+            f.write(text)
+    os.remove(AUDIO_FILENAME)
 
 def main():
     print("Attente de fichiers audio (Ctrl+C pour quitter)...")
@@ -30,13 +54,21 @@ def main():
         while True:
             if os.path.exists(AUDIO_FILENAME):
                 try:
-                    text = transcribe(AUDIO_FILENAME)
-                    if text:
-                        with open(STT_RESULT_FILE, "w", encoding="utf-8") as f:
-                            f.write(text)
-                    os.remove(AUDIO_FILENAME)
+                    handle_final()
                 except Exception as e:
                     print("Erreur transcription:", e)
+            elif os.path.exists(PARTIAL_AUDIO_FILENAME):
+                # Transcription anticipée: le pipeline peut lancer le LLM avant la finale
+                try:
+                    text, confidence = transcribe(PARTIAL_AUDIO_FILENAME)
+                    os.remove(PARTIAL_AUDIO_FILENAME)
+                    if os.path.exists(AUDIO_FILENAME):
+                        # La finale est arrivée pendant la partielle: elle passe d'abord, la partielle est périmée
+                        handle_final()
+                    elif text:
+                        send_stt_event(text, "partial", robot=ROBOT_ID, confidence=round(confidence, 3))
+                except Exception as e:
+                    print("Erreur transcription partielle:", e)
             time.sleep(0.2)
     except KeyboardInterrupt:
         print("Arrêt par l'utilisateur.")